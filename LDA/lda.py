@@ -52,19 +52,7 @@ def get_relevant_fields(item):
             }
            )
 
-def update_tz(d,dtype):
-    
-    def convert_timezone(item):
-        from_zone = tz.gettz('UTC')
-        to_zone = tz.gettz('America/New_York')
-        dt = parser.parse(item['timestamp'])
-        utc = dt.replace(tzinfo=from_zone)
-        return utc.astimezone(to_zone)
-    
-    if dtype == "sql":
-        return Row(id=d[0], time=convert_timezone(d[1]))
-    elif dtype == "pandas":
-        return convert_timezone(d[1])
+# Timezone conversion (update_tz) is shared with the streaming job, see streaming/jobs/timeconv.py
 
 
 def getTweet(string):
@@ -4,14 +4,17 @@ import matplotlib.pyplot as plt
 new_style = {'grid': False}
 matplotlib.rc('axes', **new_style)
 
-import json
-from dateutil import parser, tz
+import json, sys
 from datetime import datetime, timedelta
 
 import re
 
 data_path = 's3n://cs205-final-project/tweets/gardenhose/gop/sep16/2015-09-16-20*.gz'
 path = '/home/hadoop/'
+
+# timezone conversion is shared with the streaming job, see streaming/jobs/timeconv.py
+sys.path.append(path+'scripts')
+from timeconv import convert_column
 fname = path+'scripts/search-terms.txt' # change path to search-terms.txt as needed
 f = open(fname,'r')
 p = '|(\s|#|@)'.join([line.rstrip() for line in f.readlines()])
@@ -22,6 +25,7 @@ from pyspark.sql import SQLContext, Row
 import pyspark.sql.functions as sqlfunc
 
 sc = SparkContext()
+sc.addPyFile(path+'scripts/timeconv.py') # executors call convert_column in update_tz
 sqlContext = SQLContext(sc)
 
 def make_json(tweet):
@@ -66,19 +70,12 @@ def get_relevant_fields(item):
             }
            )
 
-def update_tz(d,dtype):
-    
-    def convert_timezone(item):
-        from_zone = tz.gettz('UTC')
-        to_zone = tz.gettz('America/New_York')
-        dt = parser.parse(item['timestamp'])
-        utc = dt.replace(tzinfo=from_zone)
-        return utc.astimezone(to_zone)
-    
-    if dtype == "sql":
-        return Row(id=d[0], time=convert_timezone(d[1]))
-    elif dtype == "pandas":
-        return convert_timezone(d[1])
+def update_tz(part):
+    ''' Converts a whole partition's timestamps to US EST as one column, yields Rows for Spark SQL '''
+    items = list(part)
+    times = convert_column([d[1]['timestamp'] for d in items])
+    for d,t in zip(items,times):
+        yield Row(id=d[0], time=str(t))
 
 n_parts  = 10
 rdd      = sc.textFile(data_path).repartition(n_parts).cache() # partitionBy fails here, need to use repartition()
@@ -87,7 +84,7 @@ filtered = (rdd.map(make_json)
                .map( get_relevant_fields, preservesPartitioning=True )
             )
 
-data = filtered.map( lambda x: update_tz(x,'sql'), preservesPartitioning=True )
+data = filtered.mapPartitions( update_tz, preservesPartitioning=True )
 df = sqlContext.createDataFrame(data).cache()
 counts = df.groupby(sqlfunc.minute("time")).count().collect()
 minutes,cts = zip(*counts)
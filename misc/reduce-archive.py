@@ -1,8 +1,8 @@
 from pyspark import *
 import time, json, boto3, re
-from dateutil import parser, tz
 from datetime import datetime, timedelta
 from sentiment import *
+from timeconv import convert_column, twitter_time_to_str
 from pyspark.sql import SQLContext, Row
 import pyspark.sql.functions as sqlfunc
 from pyspark.sql.types import *
@@ -95,7 +95,7 @@ def get_relevant_fields(item,json_terms,debate_party):
     if len(mentioned) == 0: # if no candidates were mentioned specifically
         mentioned.append( "general" ) # then tweet must be a general reference to the debate
     return (item['id'], 
-            {"timestamp":      time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(item['created_at'],'%a %b %d %H:%M:%S +0000 %Y')),
+            {"timestamp":      twitter_time_to_str(item['created_at']),
              "username":       item['user']['screen_name'],
              "text":           item['text'].encode('utf8').decode('ascii','ignore'),
              "hashtags":       [el['text'].encode('utf8').decode('ascii','ignore') for el in item['entities']['hashtags']],
@@ -275,19 +275,14 @@ def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10):
         pass
 
 
-def update_tz(d,dtype):
-    ''' Updates time zone for date stamp to US EST (the time zone of the debates) '''
-    def convert_timezone(item):
-        from_zone = tz.gettz('UTC')
-        to_zone = tz.gettz('America/New_York')
-        dt = parser.parse(item['timestamp'])
-        utc = dt.replace(tzinfo=from_zone)
-        return utc.astimezone(to_zone)
-    
-    if dtype == "sql":
-        return Row(id=d[0], time=convert_timezone(d[1]))
-    elif dtype == "pandas":
-        return convert_timezone(d[1])
+def update_tz(part):
+    ''' Updates time zone for date stamps to US EST (the time zone of the debates), for a whole
+        partition at once with mapPartitions. See timeconv.py (streaming/jobs) for the shared
+        conversion code. '''
+    items = list(part)
+    times = convert_column([d[1]['timestamp'] for d in items])
+    for d,t in zip(items,times):
+        yield Row(id=d[0], time=str(t))
 
 
 # From Thouis 'Ray' Jones CS205
@@ -1,13 +1,20 @@
+import os, sys
+import numpy as np
+
+# storage backends live with the streaming job, like in site/run.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','streaming','jobs'))
+from storage import get_store # SDB unless GD_STORAGE says otherwise, see storage.py
+
 debates = {"gop":["sep16"],"dem":["oct13"]}
 num_debates = np.concatenate(np.array(debates.values())).shape[0]
 
 ct = 0
 domain_name = "debates"
+items = []
 for party in debates:
     for ddate in debates[party]:
         ct+=1
-        client.put_attributes(
-                DomainName= domain_name,
-                ItemName  = str(ct),
-                Attributes= [{'Name':'party','Value':party},{'Name':'ddate','Value':ddate}]
-            ) 
\ No newline at end of file
+        items.append( (str(ct), [{'Name':'party','Value':party},{'Name':'ddate','Value':ddate}]) )
+
+store = get_store()
+store.put_items(domain_name, items)
@@ -97,6 +97,8 @@ def bake_emr(BUCKET_NAME, SETTINGS_KEY,
 	INSTANCE_TYPES  		 = OrderedDict() 	# Use ordered dict to get master zone first (see below)
 	INSTANCE_TYPES['MASTER'] = settings['Master_Node_Type']['val'].replace("_",".")	# Master node instance type
 	INSTANCE_TYPES['CORE'] 	 = settings['Core_Node_Type']['val'].replace("_",".")	# Core node instance type
+	# partitions for the Kafka tweets topic, ie. how many Spark tasks read from it (see start-kafka-topic.sh)
+	KAFKA_PARTITIONS = str(settings['Kafka_Partitions']['val']) if 'Kafka_Partitions' in settings else '8'
 
 
 
@@ -253,7 +255,7 @@ def bake_emr(BUCKET_NAME, SETTINGS_KEY,
 		            'ActionOnFailure': 'TERMINATE_CLUSTER',
 		            'HadoopJarStep': {
 		                'Jar': 'command-runner.jar',
-		                'Args':['/home/hadoop/scripts/start-kafka-topic.sh']
+		                'Args':['/home/hadoop/scripts/start-kafka-topic.sh', KAFKA_PARTITIONS]
 		            }
 		        },
 		        {
@@ -4,11 +4,16 @@ from random import randint
 from datetime import datetime, timedelta
 from collections import OrderedDict
 import numpy as np
-import time, json, boto3
+import time, json, boto3, os, sys
 import baker # this is a library we made with EMR baking functions
 import utils # misc helper functions, includes get/set debate schedule
 from nocache import nocache # this is a library someone else made that keeps Flask from caching results
 
+# storage backends are shared with the streaming job. Appended (not prepended) to sys.path,
+# so that our own utils.py still wins over streaming/jobs/utils.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','streaming','jobs'))
+from storage import get_store # SDB unless GD_STORAGE says otherwise, see storage.py
+
 
 ## the core flask app
 app = Flask(__name__)
@@ -85,17 +90,7 @@ def terminate(jobid):
 @nocache # we need nocache, otherwise these results may cache in some browsers and ignore new data
 def pull(table_name):
 	try:
-		client = boto3.client('sdb')
-		paginator = client.get_paginator('select')
-		output = {}
-		query = "select * from {}".format(table_name)
-		response = paginator.paginate( SelectExpression=query, ConsistentRead=True )
-		ct = 0
-		for r in response:
-			for i,row in enumerate(r['Items']):
-				ct+=1
-				output[str(row['Name'])] = row['Attributes']
-		#output["count"] = ct 
+		output = get_store().select_all(table_name)
 		return jsonify(output)
 	except Exception, e:
 		return str(e)+'error'
@@ -152,13 +147,10 @@ def gd_cluster_running(cluster_name="gauging_debate"):
 @nocache
 def get_debate_options():
 	try:
-		client  = boto3.client('sdb')
-		query = 'select * from debates'
-		results = client.select(SelectExpression=query)['Items']
+		results = get_store().select_all('debates')
 		output = []
 			
-		for r in results:
-			a = r['Attributes']
+		for a in results.values():
 			for el in a:
 				if el['Name'] == 'party':
 					party = el['Value']
@@ -178,27 +170,14 @@ def get_debate_options():
 @app.route('/get_debate_data/<start>/<end>')
 def get_debate_data(start,end):
 	try:
-		client  = boto3.client('sdb')
-		paginator = client.get_paginator('select')
 		if int(end) > 0: 
-
-			query = 'SELECT * FROM sentiment WHERE timestamp BETWEEN "{}" AND "{}"'.format(start,end)
-
+			output = get_store().select_range('sentiment',start,end)
 		else:
-			query = 'SELECT * FROM sentiment WHERE timestamp="{}"'.format(start)
-
-		output = {}
-			
-		response = paginator.paginate( SelectExpression=query, ConsistentRead=True )
-		ct = 0
-		for r in response:
-			for i,row in enumerate(r['Items']):
-				ct+=1
-				output[str(row['Name'])] = row['Attributes']
+			output = get_store().select_range('sentiment',start)
 
 		return jsonify({"data":output})
 	except Exception,e:
-		return str(e)+" "+query
+		return str(e)+" start={} end={}".format(start,end)
 
 
 ''' Scrape debate schedule and write to file '''
@@ -24,6 +24,22 @@ var views = { // for toggling between intro and chart views
 
 /* HELPER FUNCTIONS */
 
+/* How much to add to a stored batchtime (in ms) before plotting it.
+
+	Live batchtimes are plain UTC epochs (get_batchtime in streaming/jobs/utils.py), so they're
+	plotted as they are. The streaming job used to store New York wall-clock time read as UTC,
+	and we patched that here by adding timezone_offset to live data only.
+
+	Archived debates were written with the offset already in (see reduce-archive.py), and we
+	don't rewrite them, so they keep their own correction: archive_offset, which is none. If the
+	archived items ever get converted to UTC epochs, this is the one place to change.
+*/
+var archive_offset = 0;
+
+function batchtimeOffset(timeframe) {
+	return (timeframe=="past") ? archive_offset : 0;
+}
+
 function startSpinner(where) {
 	/* displays #loading div, spinner animation during AJAX queries */
 	// see: http://fgnass.github.io/spin.js/
@@ -352,19 +368,8 @@ function extractFeatures(rawdata, tmp, getrange, timeframe) {
 		}
 
 		
-		/* BAD HACK ALERT!
-
-			You discovered a day before this project was due that your streaming data is storing
-			non-offsetted timestamps (meaning it shows up in GMT not EST), but your archival data
-			stores offsetted timestamps.  That means that if you apply the timezone_offset to all 
-			data, it will show the correct (EST) time for streaming but not for archives.
-
-			Currently, you have sloppily solved this with the below conditional statement.
-			What you really need to do is go back into the Spark Streaming code and get the
-			right timestamp stored when you write to SDB.
-
-		*/
-		var offset = (timeframe=="now") ? timezone_offset : 0;
+		/* Batchtime offsets differ by data source, see batchtimeOffset. */
+		var offset = batchtimeOffset(timeframe);
 
 		/* 	X-AXIS: timestamp in milliseconds
 			Y-AXIS: sentiment average
@@ -523,7 +528,7 @@ function updateChart(original_start, end_time_secs, timeframe, interval_id) {
 	var floor_sec = Math.floor( sec / rounding_interval ) * rounding_interval;
 
 	start_time_milli 	= now.setSeconds(floor_sec);
-	start_time_secs 	= Math.floor( (now.getTime() - timezone_offset) / 1000 );
+	start_time_secs 	= Math.floor( now.getTime() / 1000 );
 	start_time_oneback 	= start_time_secs - rounding_interval; // get previous N second interval of data
 
 	if (start_time_secs < end_time_secs) {
@@ -584,7 +589,7 @@ function loadChartData(obj,timeframe) {
 
 		obj.setMinutes(obj.getMinutes()+maximum_time_span);
 
-		var end_time_secs = Math.floor( (obj.getTime() - timezone_offset) / 1000 );
+		var end_time_secs = Math.floor( obj.getTime() / 1000 );
 
 		updateChart(original_start, end_time_secs, timeframe);
 
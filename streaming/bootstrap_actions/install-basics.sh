@@ -8,7 +8,9 @@ sudo easy_install --upgrade pip
 >&2 echo "check1"
 sudo `which pip` install --upgrade requests
 >&2 echo "check2"
-sudo `which pip` install boto3 requests_oauthlib kafka-python findspark python-dateutil
+# snappy-devel is for python-snappy (Kafka message compression, see producer.py)
+sudo yum install -y snappy-devel
+sudo `which pip` install boto3 requests_oauthlib kafka-python findspark python-dateutil scipy python-snappy
 
 mkdir /home/hadoop/scripts
 mkdir /home/hadoop/.aws 
@@ -1,5 +1,9 @@
 #!/bin/bash
 
-LOCALIP=$(curl http://169.254.169.254/latest/meta-data/local-ipv4)
-/home/hadoop/kafka/bin/kafka-topics.sh --create --zookeeper $LOCALIP:2181 --replication-factor 1 --partitions 1 --topic tweets
+# number of partitions for the tweets topic (first argument, default 8).
+# spark-output.py reads each Kafka partition in its own task, so this is how many tasks ingest runs in.
+# Keep it in line with Kafka_Partitions in bake-defaults.json.
+PARTITIONS=${1:-8}
 
+LOCALIP=$(curl http://169.254.169.254/latest/meta-data/local-ipv4)
+/home/hadoop/kafka/bin/kafka-topics.sh --create --zookeeper $LOCALIP:2181 --replication-factor 1 --partitions $PARTITIONS --topic tweets
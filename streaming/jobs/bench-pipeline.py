@@ -0,0 +1,442 @@
+''' Offline benchmark of the streaming job's hot path, on local Spark.
+
+	misc/testing/test-pipeline.py and test-kafka.py need the live Twitter API (and credentials),
+	so they can't tell us whether a change made the pipeline faster. This script needs no network:
+
+		* TweetGenerator makes synthetic tweet JSON shaped like the streaming API's, with the mix we
+		  see during a debate: deletes and limit notices, retweets, non-English tweets, tweets with
+		  links, tweets that matched the track on something other than their text, and a long-tailed
+		  (Zipf) spread of mentions over the candidates, some tweets mentioning several of them.
+		* Every batch is parallelized as (key, line) records like the Kafka direct stream's, then
+		  goes through the same functions spark-output.py runs: ingest_partition (decode, filter,
+		  fields), dedup_update, write_to_db, summarize_batch (scoring and the per-candidate
+		  reduce), process() and the rolling windows (add_window_stats/subtract_window_stats,
+		  update_cumulative, write_rolling). The streaming state (see StreamState) is carried from
+		  batch to batch by hand, since there's no StreamingContext here.
+		* Writes go to a SinkStore, which just consumes the items (or to a throwaway SQLite file with
+		  --store sqlite), so we measure our code, not SDB.
+
+	It reports tweets/sec and p50/p99 batch latency, plus the per-stage counters from metrics.py:
+
+		spark-submit bench-pipeline.py --batches 20 --batch-size 10000
+		python bench-pipeline.py --cores 2 --json before.json     # findspark off-cluster, like spark-output.py
+
+	Everything is seeded (--seed), so two runs on the same machine see exactly the same tweets. The
+	first --warmup batches (Python worker startup, the labMT broadcast) are left out of the stats.
+
+	labMT comes from emotionFileReader() with --labmt s3 (s3, or the ~/.labmt cache), by default
+	it's a synthetic lexicon with labMT-like scores, so the benchmark runs anywhere.
+
+	--write tweets.gz just writes the generated tweets out, eg. to push them through Kafka and the
+	real spark-output.py with replay-in.py.
+'''
+
+import argparse, bisect, gzip, json, os, random, string, tempfile, time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+	import pyspark
+except ImportError:
+	import findspark
+	findspark.init()
+	import pyspark
+
+import numpy as np
+from utils import *
+from dedup import dedup_shard, dedup_update, report_dedup
+from storage import Store
+from metrics import getMetricsInstance, note_metrics, export_batch
+
+default_terms = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','LDA','search-terms.json')
+
+''' Share of each kind of message in the stream. Whatever is left over is original English tweets
+	without links, the only ones that make it through filter_tweets. Of those, no_match ones matched
+	the track on a screen name or URL and don't mention a term in the text, general ones mention
+	only general debate terms, and multi ones mention more than one candidate. '''
+MIX = {'delete':	  0.04,
+	   'limit':		  0.005,
+	   'retweet':	  0.35,
+	   'non_english': 0.10,
+	   'link':		  0.12,
+	   'media':		  0.03
+	  }
+MATCH_MIX = {'no_match': 0.10,
+			 'general':	 0.15,
+			 'multi':	 0.20
+			}
+DUPLICATES = 0.01 # tweets Twitter sends again (eg. after a reconnect)
+ZIPF_S	   = 1.2  # candidate popularity: the n-th most mentioned gets 1/n^ZIPF_S of the mentions
+TERM_PREFIX = ['', '', '', '#', '@'] # how a term shows up in the text
+WINDOWS	   = [('window_1m',60), ('window_5m',300)] # the rolling windows spark-output.py keeps
+
+
+def zipf_weights(n,s):
+	''' Cumulative Zipf weights for ranks 1..n, for bisect sampling '''
+	return list(np.cumsum([1.0 / (rank+1)**s for rank in range(n)]))
+
+
+def synthetic_labmt(vocabulary,seed=0,stopval=1.0):
+	''' labMT-shaped dict (word -> [rank, happs, ...] as strings) over vocabulary. Scores are spread
+		roughly like labMT's (mean ~5.4), and words within stopval of 5 are left out, like
+		emotionFileReader does. '''
+	rng = random.Random(seed)
+	labMT = {}
+	for rank, word in enumerate(vocabulary):
+		happs = min(9.0, max(1.0, rng.gauss(5.4,1.1)))
+		if abs(happs - 5.0) >= stopval:
+			labMT[word] = [str(rank+1), '{:.2f}'.format(happs), '--', '--', '--', '--']
+	return labMT
+
+
+def synthetic_vocabulary(n=10000,seed=0):
+	''' n distinct made-up lowercase words, 2 to 10 letters '''
+	rng = random.Random(seed)
+	words = set()
+	while len(words) < n:
+		words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2,10))))
+	return sorted(words)
+
+
+class TweetGenerator(object):
+	''' Makes raw streaming API lines (compact JSON, like Twitter sends) for the debate of
+		jdata['candidates'][party], see MIX for what comes out how often. '''
+
+	def __init__(self,jdata,party,vocabulary,seed=0,start=None):
+		self.rng = random.Random(seed)
+		candidates = sorted(jdata['candidates'][party].items())
+		self.rng.shuffle(candidates) # who leads the polls is up to the seed
+		self.candidates = [terms for name, terms in candidates]
+		self.candidate_weights = zipf_weights(len(candidates),ZIPF_S)
+		self.general	= list(jdata['general'])
+		self.vocabulary = vocabulary
+		self.word_weights = zipf_weights(len(vocabulary),1.0)
+		self.users		= ['user{}'.format(i) for i in range(50000)]
+		self.next_id	= 663000000000000000
+		self.now		= start if start is not None else time.time()
+		self.recent		= []
+
+	def _pick(self,weights):
+		return bisect.bisect(weights,self.rng.random() * weights[-1])
+
+	def _words(self,n):
+		return [self.vocabulary[self._pick(self.word_weights)] for _ in range(n)]
+
+	def _term(self,terms):
+		return self.rng.choice(TERM_PREFIX) + self.rng.choice(terms)
+
+	def _text(self,kind):
+		''' Tweet text of 4-25 words, with the candidate/general terms for kind put in at random places '''
+		words = self._words(self.rng.randint(4,25))
+		if kind == 'no_match':
+			terms = []
+		elif kind == 'general':
+			terms = [self._term(self.general)]
+		else:
+			first = self._pick(self.candidate_weights)
+			picked = [first]
+			if kind == 'multi':
+				for _ in range(self.rng.randint(1,2)):
+					c = self._pick(self.candidate_weights)
+					if c not in picked:
+						picked.append(c)
+			terms = [self._term(self.candidates[c]) for c in picked]
+			if self.rng.random() < 0.3:
+				terms.append(self._term(self.general))
+		for term in terms:
+			words.insert(self.rng.randint(0,len(words)),term)
+		return ' '.join(words)
+
+	def _kind(self,mix):
+		r = self.rng.random()
+		for kind, share in sorted(mix.items()):
+			if r < share:
+				return kind
+			r -= share
+		return None
+
+	def _tweet(self,kind,match,lang='en'):
+		self.next_id += self.rng.randint(1,5000)
+		user = self.rng.choice(self.users)
+		text = self._text(match)
+		hashtags = [{'text':w.lstrip('#'),'indices':[0,0]} for w in text.split(' ') if w.startswith('#')]
+		urls, media = [], None
+		if kind == 'link':
+			urls = [{'url':'https://t.co/abc{}'.format(self.next_id % 10000),'expanded_url':'http://example.com/story','indices':[0,0]}]
+		if kind == 'media':
+			media = [{'id':self.next_id,'type':'photo','media_url':'http://pbs.twimg.com/media/x.jpg','indices':[0,0]}]
+		entities = OrderedDict([('hashtags',hashtags),('urls',urls),('user_mentions',[]),('symbols',[])])
+		if media is not None:
+			entities['media'] = media
+		return OrderedDict([
+			('created_at',	 time.strftime('%a %b %d %H:%M:%S +0000 %Y',time.gmtime(self.now))),
+			('id',			 self.next_id),
+			('id_str',		 str(self.next_id)),
+			('text',		 text),
+			('source',		 '<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>'),
+			('truncated',	 False),
+			('in_reply_to_status_id', None),
+			('user',		 OrderedDict([('id',hash(user) & 0xffffffff),('screen_name',user),('name',user.title()),
+										  ('location','Somewhere, USA'),('followers_count',self.rng.randint(0,5000)),
+										  ('lang','en'),('time_zone',None)])),
+			('geo',			 None),
+			('coordinates',	 None),
+			('place',		 None),
+			('retweet_count', 0),
+			('favorite_count', 0),
+			('entities',	 entities),
+			('favorited',	 False),
+			('retweeted',	 False),
+			('filter_level', 'low'),
+			('lang',		 lang),
+			('timestamp_ms', str(int(self.now * 1000)))
+		])
+
+	def line(self,dt=0.001):
+		''' The next raw line, dt seconds after the last one '''
+		self.now += dt
+		if self.recent and self.rng.random() < DUPLICATES:
+			return self.rng.choice(self.recent)
+		kind = self._kind(MIX)
+		if kind == 'delete':
+			status = OrderedDict([('id',self.next_id - self.rng.randint(1,10**9)),('user_id',self.rng.randint(1,10**9))])
+			msg = OrderedDict([('delete',OrderedDict([('status',status),('timestamp_ms',str(int(self.now*1000)))]))])
+		elif kind == 'limit':
+			msg = {'limit':OrderedDict([('track',self.rng.randint(1,500)),('timestamp_ms',str(int(self.now*1000)))])}
+		elif kind == 'retweet':
+			msg = self._tweet(None,self._kind(MATCH_MIX))
+			msg['retweeted_status'] = self._tweet(None,'candidate')
+		else:
+			msg = self._tweet(kind,self._kind(MATCH_MIX),lang=self.rng.choice(['es','fr','pt','und']) if kind == 'non_english' else 'en')
+		line = json.dumps(msg,separators=(',',':'))
+		if msg.get('id') is not None:
+			self.recent = (self.recent + [line])[-1000:]
+		return line
+
+	def batch(self,n,seconds):
+		''' n lines spread over seconds '''
+		return [self.line(seconds / float(n)) for _ in range(n)]
+
+
+class SinkStore(Store):
+	''' Store that throws the writes away. It still runs through all the items (tweet_items is lazy,
+		so that's where the work happens), and counts them. '''
+
+	def __init__(self):
+		self.items = 0
+
+	def put_items(self,domain,items):
+		ct = sum(1 for _ in items)
+		self.items += ct
+		return {'domain':domain, 'items':ct}
+
+	def select_all(self,domain):
+		return {}
+
+	def select_range(self,domain,start,end=None,candidate=None):
+		return {}
+
+
+class StreamState(object):
+	''' The stateful DStreams of spark-output.py, one batch at a time on plain RDDs:
+			* dedup filters per shard, updated with dedup_update the way updateStateByKey does
+			* window_1m and window_5m, which add the new batch and subtract the one that slid out,
+			  like reduceByKeyAndWindow with an inverse function
+			* cumulative stats, updated with update_cumulative
+		State RDDs are cached, and checkpointed every checkpoint_interval batches (spark-output.py
+		does the same for the dedup state) so their lineage doesn't grow without bound. The
+		SparkContext needs a checkpoint directory. '''
+
+	def __init__(self,n_shards,batch_duration,capacity=200000,checkpoint_interval=10):
+		self.n_shards	 = n_shards
+		self.capacity	 = capacity
+		self.checkpoint_interval = checkpoint_interval
+		self.lengths	 = dict((name, max(1, seconds // batch_duration)) for name, seconds in WINDOWS)
+		self.batches	 = 0
+		self.dedup		 = None
+		self.windows	 = dict((name, None) for name, seconds in WINDOWS)
+		self.cumulative	 = None
+		self.history	 = [] # the last batches' window_stats, to slide them back out of the windows
+
+	def _keep(self,rdd,old=None):
+		''' Materializes a new state RDD and lets go of the one it replaces '''
+		rdd = rdd.cache()
+		if (self.batches + 1) % self.checkpoint_interval == 0:
+			rdd.checkpoint()
+		rdd.count()
+		if old is not None:
+			old.unpersist()
+		return rdd
+
+	def dedup_batch(self,tweets):
+		''' dedup_stream for one batch: returns (deduped records, (shard, stats) pairs) '''
+		n_shards, capacity = self.n_shards, self.capacity
+		keyed = tweets.map(lambda rec: (dedup_shard(rec[0],n_shards), rec))
+		if self.dedup is None:
+			state = keyed.groupByKey(n_shards).mapValues(lambda new: dedup_update(list(new),None,capacity))
+		else:
+			state = (keyed.cogroup(self.dedup,n_shards)
+						  .mapValues(lambda (new, old): dedup_update(list(new),next(iter(old),None),capacity)))
+		self.dedup = self._keep(state,self.dedup)
+		return self.dedup.flatMap(lambda kv: kv[1][1]), self.dedup.mapValues(lambda s: s[2])
+
+	def rolling_batch(self,summaries):
+		''' Adds a batch's candidate summaries to the windows and the cumulative stats. Returns
+			(candidate, (window name, window_stats)) pairs for write_rolling. '''
+		batch_stats = summaries.mapValues(window_stats).cache()
+		self.history.append(batch_stats)
+		rolling = []
+		for name, seconds in WINDOWS:
+			window = self.windows[name]
+			window = batch_stats if window is None else window.union(batch_stats).reduceByKey(add_window_stats)
+			if len(self.history) > self.lengths[name]:
+				slid = self.history[-self.lengths[name]-1]
+				window = window.leftOuterJoin(slid).mapValues(lambda (a, b): subtract_window_stats(a,b) if b is not None else a)
+			window = window.filter(lambda kv: kv[1][0] > 0) # drop candidates that left the window
+			self.windows[name] = self._keep(window,self.windows[name])
+			rolling.append(self.windows[name].mapValues(lambda ws, name=name: (name, ws)))
+
+		if self.cumulative is None:
+			cumulative = batch_stats.groupByKey().mapValues(lambda new: update_cumulative(new,None))
+		else:
+			cumulative = (batch_stats.cogroup(self.cumulative)
+									 .mapValues(lambda (new, old): update_cumulative(new,next(iter(old),None))))
+		self.cumulative = self._keep(cumulative,self.cumulative)
+		rolling.append(self.cumulative.mapValues(lambda ws: ('cumulative', ws)))
+
+		# only the longest window still needs the oldest batch
+		while len(self.history) > max(self.lengths.values()) + 1:
+			self.history.pop(0).unpersist()
+		self.batches += 1
+		return batch_stats.context.union(rolling)
+
+
+def run_batch(sc,lines,batch_time,args,matcher,labMT,jdata,store,state):
+	''' Pushes one batch through ingest -> dedup -> write_to_db -> summarize_batch -> process ->
+		rolling windows, the same way spark-output.py's DStream graph does, with state carrying the
+		dedup and window state over from the last batch. Returns (latency in seconds, exported metrics). '''
+	batchtime = get_batchtime(batch_time,args.batch_duration)
+	metrics	  = getMetricsInstance(sc)
+	projected = not args.full_decode
+
+	# stand-in for the Kafka fetch: the records are already on the executors before the clock starts
+	records = sc.parallelize([(None,line) for line in lines],args.partitions).cache()
+	records.count()
+
+	start  = time.time()
+	filtered = records.mapPartitions(lambda part: ingest_partition(part,matcher,batchtime,projected,metrics))
+	tweets, dedup_stats = state.dedup_batch(filtered)
+	note_metrics(batchtime,report_dedup(dedup_stats,batchtime,store,doPrint=False),'dedup.')
+	tweets.foreachPartition(lambda part: write_to_db(part,store=store,doPrint=False,metrics=metrics))
+	summaries = summarize_batch(tweets,labMT,n_parts=args.partitions,metrics=metrics).cache()
+	process_start = time.time()
+	process(summaries,jdata,args.party,batchtime,store)
+	note_metrics(batchtime,{'seconds':time.time()-process_start},'process.')
+	rolling_start = time.time()
+	write_rolling(state.rolling_batch(summaries),batchtime,store)
+	note_metrics(batchtime,{'seconds':time.time()-rolling_start},'rolling.')
+	latency = time.time() - start
+
+	summaries.unpersist()
+	records.unpersist()
+	return latency, export_batch(sc,batchtime,args.metrics_file)
+
+
+def report(results,args,n_lines):
+	''' Prints (and returns) throughput, latency percentiles and stage totals '''
+	latencies = np.array([latency for latency, m in results])
+	totals = {}
+	for latency, m in results:
+		for k, v in m.items():
+			if isinstance(v,(int,long,float)):
+				totals[k] = totals.get(k,0) + v
+	p50, p99 = np.percentile(latencies,[50,99])
+	out = {'batches':		  len(results),
+		   'batch_size':	  args.batch_size,
+		   'partitions':	  args.partitions,
+		   'tweets_per_sec':  n_lines / latencies.sum(),
+		   'latency_p50':	  p50,
+		   'latency_p99':	  p99,
+		   'latency_max':	  latencies.max(),
+		   'kept':			  totals.get('ingest.out',0),
+		   'duplicates':	  totals.get('dedup.duplicates',0),
+		   'stages':		  dict((k,v) for k,v in totals.items() if k.endswith('.seconds')),
+		   'drops':			  dict((k,v) for k,v in totals.items() if k.startswith('drop.'))
+		  }
+	print
+	print '{} batches of {} tweets, {} partitions, {} cores'.format(len(results),args.batch_size,args.partitions,args.cores)
+	print 'throughput:    {:.0f} tweets/sec ({} of {} kept after filtering, {} duplicates dropped)'.format(
+		out['tweets_per_sec'],out['kept'],n_lines,out['duplicates'])
+	print 'batch latency: p50 {:.3f}s, p99 {:.3f}s, max {:.3f}s'.format(p50,p99,out['latency_max'])
+	for k, v in sorted(out['drops'].items()):
+		print '  {:<18} {}'.format(k,v)
+	print 'stage time (summed over tasks):'
+	for k, v in sorted(out['stages'].items()):
+		print '  {:<18} {:.3f}s'.format(k,v)
+	return out
+
+
+if __name__ == '__main__':
+	argp = argparse.ArgumentParser(description='Offline benchmark of the streaming pipeline on local Spark')
+	argp.add_argument('--batches',type=int,default=20,help='timed batches (default: 20)')
+	argp.add_argument('--warmup',type=int,default=1,help='untimed batches first (default: 1)')
+	argp.add_argument('--batch-size',type=int,default=5000,help='raw tweets per batch (default: 5000)')
+	argp.add_argument('--batch-duration',type=int,default=30,help='seconds of stream per batch (default: 30)')
+	argp.add_argument('--partitions',type=int,default=8,help='partitions per batch, like Kafka_Partitions (default: 8)')
+	argp.add_argument('--cores',type=int,default=4,help='local Spark cores (default: 4)')
+	argp.add_argument('--dedup-capacity',type=int,default=200000,help='tweet ids per dedup shard, like Dedup_Capacity (default: 200000)')
+	argp.add_argument('--terms',default=default_terms,help='search terms json (default: LDA/search-terms.json)')
+	argp.add_argument('--party',default='gop',help='candidates[party] in the search terms (default: gop)')
+	argp.add_argument('--labmt',default='synthetic',help='"synthetic" or "s3" (emotionFileReader) (default: synthetic)')
+	argp.add_argument('--store',default='sink',help='"sink" (discard writes) or "sqlite" (a temporary file) (default: sink)')
+	argp.add_argument('--full-decode',action='store_true',help='decode whole tweets instead of prefilter + projection')
+	argp.add_argument('--seed',type=int,default=0)
+	argp.add_argument('--metrics-file',default=None,help='also write every batch\'s metrics here (JSON lines)')
+	argp.add_argument('--json',default=None,help='write the summary here, to compare runs')
+	argp.add_argument('--write',default=None,help='just write the generated tweets to this (.gz) file and exit')
+	args = argp.parse_args()
+
+	with open(args.terms) as f:
+		jdata = json.load(f)
+	vocabulary = synthetic_vocabulary(seed=args.seed)
+	generator  = TweetGenerator(jdata,args.party,vocabulary,seed=args.seed,start=1444780800) # a debate night in Oct 2015
+	n_batches  = args.warmup + args.batches
+
+	start = time.time()
+	batches = [generator.batch(args.batch_size,args.batch_duration) for _ in range(n_batches)]
+	print 'generated {} tweets in {:.1f}s'.format(n_batches*args.batch_size,time.time()-start)
+
+	if args.write is not None:
+		f = gzip.open(args.write,'wb') if args.write.endswith('.gz') else open(args.write,'wb')
+		with f:
+			for lines in batches:
+				f.write('\n'.join(lines) + '\n')
+		print 'wrote {}'.format(args.write)
+		raise SystemExit
+
+	if args.store == 'sqlite':
+		store = get_store('sqlite',path=os.path.join(tempfile.mkdtemp(),'bench.db'))
+	else:
+		store = SinkStore()
+
+	sc = pyspark.SparkContext('local[{}]'.format(args.cores),'gauging-debate-bench')
+	quiet_logs(sc)
+	sc.setCheckpointDir(tempfile.mkdtemp())
+	state	= StreamState(args.partitions,args.batch_duration,args.dedup_capacity)
+	matcher = TermMatcher(pool_search_terms(jdata),jdata['candidates'][args.party])
+	raw_labMT = emotionFileReader() if args.labmt == 's3' else synthetic_labmt(vocabulary,seed=args.seed)
+	labMT = sc.broadcast(raw_labMT)
+
+	results = []
+	for i, lines in enumerate(batches):
+		batch_time = datetime.fromtimestamp(1444780800 + i*args.batch_duration)
+		latency, m = run_batch(sc,lines,batch_time,args,matcher,labMT,jdata,store,state)
+		if i >= args.warmup:
+			results.append( (latency,m) )
+		print 'batch {}: {:.3f}s, {} tweets kept'.format(i,latency,m.get('ingest.out',0))
+
+	out = report(results,args,args.batches*args.batch_size)
+	if args.json is not None:
+		with open(args.json,'w') as f:
+			json.dump(out,f,indent=2,sort_keys=True)
+	sc.stop()
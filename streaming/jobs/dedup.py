@@ -0,0 +1,157 @@
+''' Drops duplicate tweets across micro-batches in fixed memory, with rotating Bloom filters
+	kept in Spark streaming state (see dedup_stream).
+'''
+
+import math, zlib
+from array import array
+
+
+_POPCOUNT = [bin(b).count('1') for b in range(256)]
+
+def _hashes(key):
+	''' Two independent 32-bit hashes of key, for double hashing '''
+	key = str(key)
+	return zlib.crc32(key) & 0xffffffff, (zlib.adler32(key) & 0xffffffff) | 1
+
+
+class BloomFilter(object):
+	''' Plain Bloom filter sized for capacity keys at error_rate false positives.
+		Bits are an array('B'), which pickles as one string (bytearray doesn't, in Python 2). '''
+
+	def __init__(self,capacity,error_rate=0.001):
+		self.capacity	= capacity
+		self.error_rate = error_rate
+		self.n_bits		= int(math.ceil(-capacity * math.log(error_rate) / math.log(2)**2))
+		self.n_hashes	= max(1, int(round(self.n_bits / float(capacity) * math.log(2))))
+		self.bits		= array('B', [0]) * ((self.n_bits + 7) // 8)
+		self.count		= 0
+
+	def _positions(self,key):
+		h1, h2 = _hashes(key)
+		return [(h1 + i*h2) % self.n_bits for i in range(self.n_hashes)]
+
+	def add(self,key):
+		for p in self._positions(key):
+			self.bits[p >> 3] |= 1 << (p & 7)
+		self.count += 1
+
+	def __contains__(self,key):
+		bits = self.bits
+		for p in self._positions(key):
+			if not bits[p >> 3] & (1 << (p & 7)):
+				return False
+		return True
+
+	def fill_ratio(self):
+		''' Fraction of the bits that are set '''
+		return sum(_POPCOUNT[b] for b in self.bits) / float(self.n_bits)
+
+	def estimated_fp_rate(self):
+		''' Chance that a key we never added looks present, given how full the filter is '''
+		return self.fill_ratio() ** self.n_hashes
+
+	def size(self):
+		''' Memory taken by the bits, in bytes '''
+		return len(self.bits)
+
+
+class RotatingBloomFilter(object):
+	''' Two generations of BloomFilter: the current one takes inserts and the previous one is still
+		checked. Once the current one has taken capacity ids, the previous one is thrown away and
+		replaced, so memory never grows and we remember at least the last capacity ids (at most the
+		last 2 * capacity). A false positive drops a tweet we've never seen, that's the price for
+		fixed memory. seen() is check-and-add. '''
+
+	def __init__(self,capacity,error_rate=0.001):
+		self.capacity	= capacity
+		self.error_rate = error_rate
+		self.current	= BloomFilter(capacity,error_rate)
+		self.previous	= None
+		self.rotations	= 0
+
+	def seen(self,key):
+		''' True if key was (probably) seen before. Otherwise remembers it and returns False. '''
+		if key in self.current or (self.previous is not None and key in self.previous):
+			return True
+		if self.current.count >= self.capacity:
+			self.previous  = self.current
+			self.current   = BloomFilter(self.capacity,self.error_rate)
+			self.rotations += 1
+		self.current.add(key)
+		return False
+
+	def estimated_fp_rate(self):
+		''' Chance that a new key gets reported as seen: it can hit either generation '''
+		p_current  = self.current.estimated_fp_rate()
+		p_previous = self.previous.estimated_fp_rate() if self.previous is not None else 0.0
+		return 1.0 - (1.0 - p_current) * (1.0 - p_previous)
+
+	def size(self):
+		return self.current.size() + (self.previous.size() if self.previous is not None else 0)
+
+
+def dedup_shard(tweet_id,n_shards):
+	''' Which shard (state key) a tweet id belongs to '''
+	return (zlib.crc32(str(tweet_id)) & 0xffffffff) % n_shards
+
+
+def dedup_update(new_records,state,capacity=200000,error_rate=0.001):
+	''' updateStateByKey function for one shard.
+
+		state is (RotatingBloomFilter, records that passed in the last batch, stats) and new_records
+		are this batch's records for the shard (anything with the tweet id first, eg. Tweet). Returns the new state, whose middle
+		element is this batch's unique records. We never return None, that would drop the filter. '''
+	bloom = state[0] if state is not None else RotatingBloomFilter(capacity,error_rate)
+	passed = []
+	for record in new_records:
+		if not bloom.seen(record[0]):
+			passed.append( record )
+	stats = {'records':	   len(new_records),
+			 'duplicates': len(new_records) - len(passed),
+			 'fp_rate':	   bloom.estimated_fp_rate() if len(new_records) > 0 else (state[2]['fp_rate'] if state is not None else 0.0),
+			 'bytes':	   bloom.size(),
+			 'rotations':  bloom.rotations
+			}
+	return (bloom, passed, stats)
+
+
+def dedup_stream(dstream,n_shards,capacity=200000,error_rate=0.001,checkpoint_interval=None):
+	''' Drops tweets whose id has been seen before from a DStream of records with the tweet id
+		first (Tweet records, see tweetrecord.py, or (id, data) pairs).
+		Returns (deduped DStream of the same records, DStream of (shard, stats)).
+
+		Records get shuffled into n_shards partitions by id, so all copies of a tweet meet the same
+		filter. capacity is per shard and generation, so memory is about
+		n_shards * 2 * capacity * 1.8 bytes at error_rate=0.001. '''
+	state = (dstream.map(lambda rec: (dedup_shard(rec[0],n_shards), rec))
+					.updateStateByKey(lambda new, last: dedup_update(new,last,capacity,error_rate), n_shards)
+			)
+	if checkpoint_interval is not None:
+		# the filters are the biggest part of the state, no need to checkpoint them every batch
+		state.checkpoint(checkpoint_interval)
+	deduped = state.flatMap(lambda kv: kv[1][1])
+	stats	= state.mapValues(lambda s: s[2])
+	return deduped, stats
+
+
+def report_dedup(rdd,batchtime,store=None,domain_name='dedup',doPrint=True):
+	''' Sums up the per-shard dedup stats for one batch, prints them and writes them to domain_name.
+		Returns the totals (a dict), or None for an empty batch. '''
+	shards = rdd.values().collect()
+	if len(shards) == 0:
+		return None
+	records	   = sum(s['records'] for s in shards)
+	duplicates = sum(s['duplicates'] for s in shards)
+	fp_rate	   = max(s['fp_rate'] for s in shards)
+	memory	   = sum(s['bytes'] for s in shards)
+	if doPrint:
+		print 'dedup {}: {} duplicates of {} tweets, estimated false positive rate {:.4%}, {:.1f} MB of filters'.format(
+			batchtime,duplicates,records,fp_rate,memory/1e6)
+	if store is not None:
+		attrs = [{'Name':'timestamp',  'Value':batchtime,		'Replace':True},
+				 {'Name':'records',	   'Value':str(records),	'Replace':True},
+				 {'Name':'duplicates', 'Value':str(duplicates),	'Replace':True},
+				 {'Name':'fp_rate',	   'Value':str(fp_rate),	'Replace':True},
+				 {'Name':'bytes',	   'Value':str(memory),		'Replace':True}]
+		store.put_items(domain_name,[(batchtime,attrs)])
+	return {'records':records, 'duplicates':duplicates, 'fp_rate':fp_rate, 'bytes':memory}
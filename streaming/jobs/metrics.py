@@ -0,0 +1,158 @@
+''' Per-stage counters for the streaming job, summed over tasks in one accumulator and exported
+	per batch as JSON lines and/or Prometheus text (see export_batch).
+'''
+
+import json, time, threading
+from pyspark.accumulators import AccumulatorParam
+
+PREFIX = 'gauging_debate_'
+
+
+class CounterParam(AccumulatorParam):
+	''' Accumulates dicts of counters by adding them up key by key '''
+
+	def zero(self,value):
+		return {}
+
+	def addInPlace(self,a,b):
+		for k, v in b.items():
+			a[k] = a.get(k,0) + v
+		return a
+
+
+def getMetricsInstance(sparkContext):
+	''' Lazily instantiated global metrics accumulator. Like broadcasts, accumulators can't be
+		restored from a checkpoint, so DStream functions fetch it through here. '''
+	if ('metricsAccumulatorInstance' not in globals()):
+		globals()['metricsAccumulatorInstance'] = sparkContext.accumulator({},CounterParam())
+	return globals()['metricsAccumulatorInstance']
+
+
+class Counters(object):
+	''' Local tally for one task, added to the accumulator in one go by flush().
+		Accumulators updated in transformations count twice if a task is retried or a partition is
+		recomputed, so treat the totals as close estimates, not exact accounting. '''
+
+	def __init__(self,accumulator=None):
+		self.accumulator = accumulator
+		self.values		 = {}
+
+	def add(self,name,n=1):
+		self.values[name] = self.values.get(name,0) + n
+
+	def flush(self):
+		if self.accumulator is not None and len(self.values) > 0:
+			self.accumulator.add(self.values)
+		self.values = {}
+
+
+''' Driver-side numbers (lag, dedup, process() time) for each batch, by batchtime, until the
+	batch gets exported. Same idea as _batch_offsets in utils.py. '''
+_driver_metrics = {}
+
+def note_metrics(batchtime,values,prefix=''):
+	''' Adds numeric values (a dict) to batchtime's driver-side metrics, names prefixed with prefix '''
+	if values is None:
+		return values
+	batch = _driver_metrics.setdefault(batchtime,{})
+	for k, v in values.items():
+		if isinstance(v,(int,long,float)) and not isinstance(v,bool):
+			batch[prefix+k] = v
+	return values
+
+
+def derived_metrics(m):
+	''' Rates and latencies worked out from the raw counters '''
+	out = {}
+	if m.get('write.batches',0) > 0:
+		out['write.latency'] = m.get('write.seconds',0.0) / m['write.batches']
+	if m.get('ingest.seconds',0) > 0:
+		out['ingest.rate'] = m.get('ingest.records',0) / m['ingest.seconds']
+	if m.get('score.seconds',0) > 0:
+		out['score.rate'] = m.get('score.records',0) / m['score.seconds']
+	return out
+
+
+def prometheus_text(batch,totals):
+	''' Prometheus exposition format: running totals of the counters, and the last batch's values
+		as gauges. '''
+	lines = []
+	for k in sorted(totals):
+		name = PREFIX + k.replace('.','_') + '_total'
+		lines.append('# TYPE {} counter'.format(name))
+		lines.append('{} {}'.format(name,totals[k]))
+	for k in sorted(batch):
+		name = PREFIX + 'batch_' + k.replace('.','_')
+		lines.append('# TYPE {} gauge'.format(name))
+		lines.append('{} {}'.format(name,batch[k]))
+	return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+	''' Writes each batch's metrics as a JSON line to path, and/or serves the latest batch (plus
+		running totals) in Prometheus text format at http://<driver>:port/metrics. '''
+
+	def __init__(self,path=None,port=None,doPrint=False):
+		self.path	 = path
+		self.port	 = port
+		self.doPrint = doPrint
+		self.totals	 = {}
+		self.latest	 = ''
+		if port is not None:
+			self.serve(port)
+
+	def serve(self,port):
+		import BaseHTTPServer
+		exporter = self
+
+		class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = exporter.latest
+				self.send_response(200)
+				self.send_header('Content-Type','text/plain; version=0.0.4')
+				self.send_header('Content-Length',str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+			def log_message(self,*args):
+				pass
+
+		server = BaseHTTPServer.HTTPServer(('',port),Handler)
+		thread = threading.Thread(target=server.serve_forever,name='metrics-http')
+		thread.daemon = True
+		thread.start()
+
+	def export(self,batchtime,counters,driver):
+		batch = dict(counters)
+		batch.update(driver)
+		batch.update(derived_metrics(batch))
+		for k, v in counters.items():
+			self.totals[k] = self.totals.get(k,0) + v
+		self.latest = prometheus_text(batch,self.totals)
+		if self.path is not None:
+			with open(self.path,'a') as f:
+				f.write(json.dumps(dict(batch,batchtime=batchtime,exported=time.time()),sort_keys=True) + '\n')
+		if self.doPrint:
+			print 'metrics {}: {}'.format(batchtime,', '.join('{}={:.4g}'.format(k,v) for k,v in sorted(batch.items())))
+		return batch
+
+
+_exporters = {}
+
+def getExporterInstance(path=None,port=None,doPrint=False):
+	''' One exporter (and HTTP server) per driver, created on first use '''
+	key = (path,port)
+	if key not in _exporters:
+		_exporters[key] = MetricsExporter(path,port,doPrint)
+	return _exporters[key]
+
+
+def export_batch(sparkContext,batchtime,path=None,port=None,doPrint=False):
+	''' Reads and resets the executor counters, adds the batch's driver-side metrics and exports
+		them. Run it as the batch's last output operation, so every stage has reported in. '''
+	accumulator = getMetricsInstance(sparkContext)
+	counters = dict(accumulator.value)
+	accumulator.value = {}
+	driver = _driver_metrics.pop(batchtime,{})
+	for old in [b for b in _driver_metrics if b < batchtime]:
+		del _driver_metrics[old]
+	return getExporterInstance(path,port,doPrint).export(batchtime,counters,driver)
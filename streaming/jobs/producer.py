@@ -0,0 +1,312 @@
+''' Asynchronous, batched, compressed Kafka producer for the tweet ingest scripts, with a local
+	spill file for when Kafka is down (see AsyncProducer).
+'''
+
+import os, re, time, zlib, threading, Queue
+
+# Kafka message set compression attribute values
+CODECS = {'none':0x00, 'gzip':0x01, 'snappy':0x02, 'lz4':0x03}
+
+_STOP = object() # tells the sender thread to finish up
+
+
+def codec_available(name):
+	''' True if kafka-python can compress with codec name here '''
+	from kafka import codec
+	check = {'none':   lambda: True,
+			 'gzip':   codec.has_gzip,
+			 'snappy': codec.has_snappy,
+			 'lz4':    getattr(codec,'has_lz4',lambda: False)
+			}.get(name)
+	return check is not None and check()
+
+
+def make_producer(client,codec='snappy',**kwargs):
+	''' Returns (SimpleProducer, codec name actually used), falling back to gzip if codec isn't
+		available or this kafka-python's producer doesn't take it. '''
+	from kafka import SimpleProducer
+	make = lambda c: SimpleProducer(client,codec=c,**kwargs)
+	if codec_available(codec):
+		try:
+			return make(CODECS[codec]), codec
+		except Exception, e:
+			print 'kafka codec {} not supported by this client ({}), using gzip'.format(codec,str(e))
+	else:
+		print 'kafka codec {} not available, using gzip'.format(codec)
+	return make(CODECS['gzip']), 'gzip'
+
+
+TWEET_ID = re.compile(r'"id":(\d+)')
+
+def tweet_key(line):
+	''' Partition key for a raw tweet line: a hash of the tweet id (the first "id" in the line,
+		which is the tweet's own in Twitter's JSON and in our prefiltered lines).
+		We hash the id because the low bits of Twitter's ids aren't evenly spread. '''
+	m = TWEET_ID.search(line)
+	return zlib.crc32(m.group(1)) & 0xffffffff if m is not None else 0
+
+
+class SpillBuffer(object):
+	''' Append-only file of newline-delimited messages that couldn't be sent to Kafka.
+
+		drain() renames the file before reading it, so new spills go to a fresh file meanwhile.
+		If a send fails partway through, the rest goes back into the spill file. '''
+
+	def __init__(self,path):
+		self.path	  = os.path.abspath(os.path.expanduser(path))
+		self.draining = self.path + '.draining'
+		self.lock	  = threading.Lock()
+		self.spilled  = 0
+		self.drained  = 0
+
+	def append(self,lines):
+		with self.lock:
+			with open(self.path,'ab') as f:
+				for line in lines:
+					f.write(line + '\n')
+			self.spilled += len(lines)
+
+	def pending(self):
+		''' True if there's anything left to drain (including from an earlier run) '''
+		return any(os.path.exists(p) and os.path.getsize(p) > 0 for p in (self.path,self.draining))
+
+	def drain(self,send,batch_size=500):
+		''' Sends the spilled messages with send(batch), batch_size at a time, and returns how many
+			were sent. If a send raises, whatever wasn't sent goes back into the spill file and the
+			exception is passed on. '''
+		with self.lock:
+			# a .draining file left over from a crash goes first
+			if not os.path.exists(self.draining):
+				if not os.path.exists(self.path):
+					return 0
+				os.rename(self.path,self.draining)
+
+		sent  = 0
+		batch = []
+		try:
+			with open(self.draining,'rb') as f:
+				lines = (line.rstrip('\n') for line in f)
+				try:
+					for line in lines:
+						batch.append(line)
+						if len(batch) >= batch_size:
+							send(batch)
+							sent += len(batch)
+							batch = []
+					if len(batch) > 0:
+						send(batch)
+						sent += len(batch)
+				except:
+					self.append(batch + list(lines))
+					raise
+		finally:
+			os.remove(self.draining)
+			self.drained += sent
+		return sent
+
+
+class AsyncProducer(object):
+	''' Sends lines to a Kafka topic in compressed batches, from a background thread.
+
+		put() only queues the line. The sender thread sends up to batch_size lines (or whatever
+		showed up within linger seconds) as one compressed message set. If the queue is full, put()
+		waits at most put_timeout seconds and then drops the line.
+
+		Batches that still fail after max_retries go to spill (a SpillBuffer path). Until a send gets
+		through again, the sender spills new batches straight to disk and only probes Kafka every
+		probe_interval seconds, and put() spills instead of dropping. Spilled lines get sent once
+		Kafka is back, or on the next run.
+
+		With key (eg. tweet_key), each batch is split by partition and every set is sent with the
+		producer's _send_messages(topic, partition, ...), so the same tweet always lands on the same
+		partition. Without a key, SimpleProducer rotates whole batches over the partitions.
+
+		Usage:
+			producer = AsyncProducer(kafka_host)
+			for line in response.iter_lines():
+				producer.put(line)
+			producer.close() # sends whatever is still queued, returns the stats '''
+
+	def __init__(self,kafka_host,topic='tweets',codec='snappy',batch_size=500,linger=0.5,
+				 queue_size=20000,put_timeout=0.1,max_retries=3,backoff=0.5,spill=None,probe_interval=5,
+				 key=None,client=None,doPrint=False):
+		from kafka import KafkaClient
+
+		self.topic		 = topic
+		self.batch_size	 = batch_size
+		self.linger		 = linger
+		self.put_timeout = put_timeout
+		self.max_retries = max_retries
+		self.backoff	 = backoff
+		self.doPrint	 = doPrint
+		# spill is a SpillBuffer or a file path, None means failed batches are dropped
+		self.spill			= SpillBuffer(spill) if isinstance(spill,basestring) else spill
+		self.probe_interval = probe_interval
+		self.down_since		= None # when Kafka became unreachable
+		self.last_probe		= 0.0
+		# key is a function of the message (eg. tweet_key) returning an int, None means no keys
+		self.key			= key
+		self.partition_ids	= None
+
+		# client is an already connected KafkaClient (or anything that acts like one), None connects to kafka_host
+		self.client				   = client if client is not None else KafkaClient(kafka_host)
+		self.producer, self.codec  = make_producer(self.client,codec)
+		self.queue				   = Queue.Queue(maxsize=queue_size)
+
+		self.queued  = 0
+		self.dropped = 0
+		self.sent	 = 0
+		self.failed	 = 0
+		self.batches = 0
+		self.bytes	 = 0
+		self.seconds = 0.0
+
+		self.sender = threading.Thread(target=self._run,name='kafka-sender')
+		self.sender.daemon = True
+		self.sender.start()
+
+	def put(self,line):
+		''' Queues one message. Returns False if the queue stayed full and the line was dropped. '''
+		try:
+			self.queue.put(line,timeout=self.put_timeout)
+			self.queued += 1
+			return True
+		except Queue.Full:
+			if self.spill is not None and self.down_since is not None:
+				self.spill.append([line])
+				return True
+			self.dropped += 1
+			return False
+
+	def _next_batch(self):
+		''' Blocks for the first message, then takes whatever else arrives within linger seconds.
+			Returns (batch, stop) where stop means close() was called. '''
+		batch = []
+		item = self.queue.get()
+		if item is _STOP:
+			return batch, True
+		batch.append(item)
+		deadline = time.time() + self.linger
+		while len(batch) < self.batch_size:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				break
+			try:
+				item = self.queue.get(timeout=remaining)
+			except Queue.Empty:
+				break
+			if item is _STOP:
+				return batch, True
+			batch.append(item)
+		return batch, False
+
+	def _run(self):
+		if self.spill is not None and self.spill.pending():
+			self._drain()
+		stop = False
+		while not stop:
+			batch, stop = self._next_batch()
+			if len(batch) > 0:
+				self._send(batch)
+			if self.down_since is None and self.spill is not None and self.spill.pending():
+				self._drain()
+
+	def partitions(self):
+		''' The topic's partition ids, sorted, looked up the first time we need them '''
+		if self.partition_ids is None:
+			self.client.load_metadata_for_topics(self.topic)
+			ids = sorted(self.client.get_partition_ids_for_topic(self.topic))
+			if len(ids) == 0:
+				raise Exception('no partitions found for topic {}'.format(self.topic))
+			self.partition_ids = ids
+			if self.doPrint:
+				print 'kafka topic {} has {} partitions'.format(self.topic,len(ids))
+		return self.partition_ids
+
+	def _send_batch(self,batch):
+		start = time.time()
+		try:
+			if self.key is None:
+				self.producer.send_messages(self.topic,*batch)
+			else:
+				ids = self.partitions()
+				by_partition = {}
+				for m in batch:
+					by_partition.setdefault(ids[self.key(m) % len(ids)],[]).append(m)
+				for partition, messages in sorted(by_partition.items()):
+					self.producer._send_messages(self.topic,partition,*messages)
+		finally:
+			self.batches += 1
+			self.seconds += time.time() - start
+		self.sent  += len(batch)
+		self.bytes += sum(len(m) for m in batch)
+
+	def _send(self,batch):
+		''' One compressed message set per batch (per partition, if keyed), retried with exponential
+			backoff. A keyed batch that fails halfway gets resent whole, duplicates are dropped
+			downstream. While Kafka is down we only try once every probe_interval seconds, and spill the rest. '''
+		if self.down_since is not None:
+			if time.time() - self.last_probe < self.probe_interval:
+				self._failed(batch)
+				return
+			self.last_probe = time.time()
+			retries = 0
+		else:
+			retries = self.max_retries
+
+		for attempt in range(retries+1):
+			try:
+				self._send_batch(batch)
+				if self.down_since is not None and self.doPrint:
+					print 'kafka reachable again after {:.0f}s'.format(time.time() - self.down_since)
+				self.down_since = None
+				return
+			except Exception, e:
+				if attempt < retries:
+					time.sleep(self.backoff * 2**attempt)
+					continue
+				if self.down_since is None:
+					print 'kafka send error ({} messages): {}'.format(len(batch),str(e))
+					self.down_since = self.last_probe = time.time()
+				self._failed(batch)
+
+	def _failed(self,batch):
+		if self.spill is not None:
+			self.spill.append(batch)
+		else:
+			self.failed += len(batch)
+
+	def _drain(self):
+		try:
+			sent = self.spill.drain(self._send_batch,self.batch_size)
+		except Exception, e:
+			print 'kafka send error while draining spill file: {}'.format(str(e))
+			self.down_since = self.last_probe = time.time()
+			return
+		if self.doPrint and sent > 0:
+			print 'kafka: sent {} spilled messages'.format(sent)
+
+	def close(self,timeout=30):
+		''' Sends everything still queued, stops the sender thread and returns the stats '''
+		self.queue.put(_STOP)
+		self.sender.join(timeout)
+		stats = self.stats()
+		if self.doPrint:
+			print 'kafka {topic} ({codec}): {sent} sent in {batches} batches, {failed} failed, {dropped} dropped, {spilled} spilled, {rate:.1f} msgs/sec'.format(**stats)
+		return stats
+
+	def stats(self):
+		return {'topic':   self.topic,
+				'codec':   self.codec,
+				'queued':  self.queued,
+				'sent':	   self.sent,
+				'failed':  self.failed,
+				'dropped': self.dropped,
+				'batches': self.batches,
+				'bytes':   self.bytes,
+				'backlog': self.queue.qsize(),
+				'spilled': self.spill.spilled if self.spill is not None else 0,
+				'drained': self.spill.drained if self.spill is not None else 0,
+				'seconds': self.seconds,
+				'rate':	   self.sent/self.seconds if self.seconds > 0 else 0.0
+			   }
@@ -0,0 +1,125 @@
+''' Keeping the streaming job caught up with the tweet stream: Spark's backpressure settings
+	(streaming_conf) and a per-batch lag report (LagEstimator, report_lag).
+'''
+
+import time
+
+MAX_RATE_PER_PARTITION = 2000 # records/sec, per Kafka partition
+MIN_RATE			   = 100  # backpressure never throttles below this (records/sec)
+TARGET_UTILIZATION	   = 0.8  # aim to spend at most this fraction of the batch interval processing
+SMOOTHING			   = 0.3  # weight of the newest batch in the sustained rate estimate
+
+
+def streaming_conf(settings):
+	''' Spark settings for backpressure and the Kafka ingest cap, as (key, value) pairs for
+		SparkConf.setAll(). The cap can be overridden with Max_Rate_Per_Partition in bake-defaults.json.
+
+		Backpressure sizes each Kafka read from how fast the last batches were processed, and
+		maxRatePerPartition is a hard ceiling on it. That's the only throttling there is. The direct
+		Kafka stream only reads these when it's created, so changes need a new run. '''
+	if 'Max_Rate_Per_Partition' in settings:
+		max_rate = int(settings['Max_Rate_Per_Partition']['val'])
+	else:
+		max_rate = MAX_RATE_PER_PARTITION
+	return [('spark.streaming.backpressure.enabled',	   'true'),
+			('spark.streaming.backpressure.pid.minRate',   str(MIN_RATE)),
+			('spark.streaming.kafka.maxRatePerPartition', str(max_rate))
+		   ]
+
+
+class LagEstimator(object):
+	''' Per-batch lag and throughput figures for the report, worked out on the driver.
+
+		Spark runs one batch at a time, so a batch starts processing when it's due (batch_time) or
+		when the one before it finished, whichever is later. From that and the time the batch's last
+		output finished we get:
+			processing_time  = finished - max(batch_time, last finished)
+			scheduling_delay = time the batch sat waiting for the ones before it
+			lag				 = finished - batch_time, ie. how far behind real time the chart is
+
+		estimated_rate is an exponentially smoothed processing rate (records/sec), ie. roughly the
+		ingest rate we can sustain. Nothing feeds it back into Spark, backpressure does the throttling.
+
+		Usage:
+			le = LagEstimator(BATCH_DURATION)
+			stats = le.update(batch_time, records) # once the batch's last output is done '''
+
+	def __init__(self,batch_duration,smoothing=SMOOTHING):
+		self.batch_duration = batch_duration
+		self.smoothing		= smoothing
+
+		self.rate		   = None # sustained processing rate, records/sec
+		self.last_finished = None
+		self.batches	   = 0
+		self.behind		   = 0 # batches in a row whose processing time went over the interval
+
+	def update(self,batch_time,records,finished=None):
+		''' Takes a finished batch (batch_time is its epoch seconds) and returns its stats dict '''
+		finished = finished if finished is not None else time.time()
+		started  = batch_time if self.last_finished is None else max(batch_time,self.last_finished)
+		processing_time  = max(finished - started, 1e-3)
+		scheduling_delay = max(started - batch_time, 0.0)
+		self.last_finished = finished
+		self.batches += 1
+
+		processing_rate = records / processing_time
+		if records > 0:
+			self.estimate(processing_rate)
+
+		if processing_time > self.batch_duration:
+			self.behind += 1
+		else:
+			self.behind = 0
+
+		return {'records':			records,
+				'processing_time':	processing_time,
+				'scheduling_delay':	scheduling_delay,
+				'lag':				finished - batch_time,
+				'processing_rate':	processing_rate,
+				'estimated_rate':	self.rate,
+				# records still queued up behind this batch, roughly
+				'backlog':			int(scheduling_delay * processing_rate),
+				'suggested_batch':	self.suggested_batch_duration(processing_time),
+				'behind':			self.behind
+			   }
+
+	def estimate(self,processing_rate):
+		''' Folds one batch's processing rate into the sustained rate estimate '''
+		if self.rate is None:
+			self.rate = processing_rate
+		else:
+			self.rate = self.smoothing * processing_rate + (1 - self.smoothing) * self.rate
+		return self.rate
+
+	def suggested_batch_duration(self,processing_time):
+		''' Smallest whole-second interval that would keep this batch at TARGET_UTILIZATION '''
+		return max(self.batch_duration, int(-(-processing_time // TARGET_UTILIZATION)))
+
+
+_estimators = {}
+
+def get_lag_estimator(batch_duration):
+	''' One LagEstimator per driver. It lives here rather than in the foreachRDD closures,
+		since those get pickled into the checkpoint along with whatever state they hold. '''
+	le = _estimators.get(batch_duration)
+	if le is None:
+		le = _estimators[batch_duration] = LagEstimator(batch_duration)
+	return le
+
+
+def report_lag(batch_time,records,batch_duration,store=None,domain_name='lag',doPrint=True):
+	''' Updates the lag estimator with a finished batch and writes its stats to domain_name,
+		keyed by batch time. batch_time is the batch's epoch seconds. Returns the stats dict. '''
+	stats = get_lag_estimator(batch_duration).update(batch_time,records)
+	if doPrint:
+		print 'batch {}: {} records in {:.2f}s (interval {}s), {:.2f}s scheduling delay, {:.2f}s behind, sustained rate {}'.format(
+			int(batch_time),records,stats['processing_time'],batch_duration,stats['scheduling_delay'],stats['lag'],
+			'n/a' if stats['estimated_rate'] is None else '{:.0f}/s'.format(stats['estimated_rate']))
+		if stats['behind'] > 0:
+			print 'WARNING: processing is slower than the batch interval ({} batches in a row), suggested Batch_Duration: {}s'.format(
+				stats['behind'],stats['suggested_batch'])
+	if store is not None:
+		attrs = [{'Name':'timestamp','Value':str(int(batch_time)),'Replace':True}]
+		attrs += [{'Name':k,'Value':str(v),'Replace':True} for k,v in stats.items()]
+		store.put_items(domain_name,[(str(int(batch_time)),attrs)])
+	return stats
@@ -0,0 +1,130 @@
+''' Replays archived tweets into Kafka, as a stand-in for twitter-in.py.
+
+	Reads gzipped (or plain) newline-delimited tweet JSON files, like the archives of past debates
+	that misc/reduce-archive.py works on, and publishes every line to the tweets topic. Tweets keep
+	the spacing they originally had, sped up by --speed:
+
+		python replay-in.py /mnt1/data/sep16/*.gz                   # real time
+		python replay-in.py --speed 10 /mnt1/data/sep16/*.gz        # 10x real time
+		python replay-in.py --speed max /mnt1/data/sep16/*.gz       # as fast as Kafka takes them
+
+	We use it to load-test spark-output.py well past debate peak without a network connection,
+	and to rebuild the result tables of an old debate:
+
+		spark-submit spark-output.py --replay
+		python replay-in.py --clock --speed 10 /mnt1/data/sep16/*.gz
+
+	Timing comes from each tweet's timestamp_ms field, or created_at (to the second) for archives
+	that don't have it. Lines without either (eg. some limit notices) go out right after the line
+	before them.
+
+	spark-output.py stores tweets under the batch they arrive in, so without --clock the batchtimes
+	are replay time. --clock writes the replay's clock to the store (see replayclock.py), and
+	spark-output.py --replay uses it to store every batch of the replay under the original time of
+	its tweets, so the site can serve the rebuilt tables for the original debate. That needs a
+	paced replay (not --speed max). At 10x, each 30s batch covers 5 minutes of the debate, and the
+	rolling windows (window_1m etc.) span 10x as much debate time.
+'''
+
+import argparse, glob, gzip, re, time
+from producer import AsyncProducer, tweet_key
+from timeconv import parse_twitter_time
+from replayclock import write_clock
+
+TIMESTAMP_MS = re.compile(r'"timestamp_ms":"(\d+)"')
+CREATED_AT	 = re.compile(r'"created_at":"([^"]+)"')
+EPOCH		 = parse_twitter_time('Thu Jan 01 00:00:00 +0000 1970')
+
+
+def tweet_time(line):
+	''' Epoch seconds (float) a raw tweet line was created at, or None if it doesn't say.
+		We only regex the raw line here, decoding every tweet would cap the replay speed. '''
+	m = TIMESTAMP_MS.search(line)
+	if m is not None:
+		return int(m.group(1)) / 1000.0
+	m = CREATED_AT.search(line)
+	if m is not None:
+		try:
+			return (parse_twitter_time(m.group(1)) - EPOCH).total_seconds()
+		except Exception:
+			return None
+	return None
+
+
+def read_lines(paths):
+	''' Yields non-empty lines from each file in paths, in order. .gz files are decompressed. '''
+	for path in paths:
+		f = gzip.open(path,'rb') if path.endswith('.gz') else open(path,'rb')
+		try:
+			for line in f:
+				line = line.rstrip('\r\n')
+				if line:
+					yield line
+		finally:
+			f.close()
+
+
+def replay(lines,producer,speed=1.0,report_every=10,limit=None,on_first=None):
+	''' Sends lines with producer, sleeping so that tweets go out at speed times their original pace
+		(speed=None means no sleeping at all). Returns the number of lines sent.
+		on_first(start, first) is called before the first timed tweet goes out, with the epoch the
+		replay started at and that tweet's original epoch. '''
+	start	  = time.time()
+	first	  = None # timestamp of the first tweet we saw
+	ct		  = 0
+	last_time = start
+	for line in lines:
+		if speed is not None:
+			ts = tweet_time(line)
+			if ts is not None:
+				if first is None:
+					first = ts
+					if on_first is not None:
+						on_first(start,first)
+				wait = start + (ts - first) / speed - time.time()
+				if wait > 0.001:
+					time.sleep(wait)
+		producer.put(line)
+		ct += 1
+		if report_every and time.time() - last_time >= report_every:
+			last_time = time.time()
+			print 'replayed {} tweets in {:.0f}s ({:.0f}/sec)'.format(ct,last_time-start,ct/(last_time-start))
+		if limit is not None and ct >= limit:
+			break
+	return ct
+
+
+if __name__ == '__main__':
+	argp = argparse.ArgumentParser(description='Replay archived tweet files into Kafka')
+	argp.add_argument('files',nargs='+',help='gzipped or plain newline-delimited tweet files (globs ok)')
+	argp.add_argument('--speed',default='1',help='replay speed multiplier, or "max" for no pacing (default: 1)')
+	argp.add_argument('--kafka',default='localhost:9092',help='Kafka host:port (default: localhost:9092)')
+	argp.add_argument('--topic',default='tweets')
+	argp.add_argument('--codec',default='snappy',help='snappy, gzip, lz4 or none (default: snappy)')
+	argp.add_argument('--key',default='id',help='partition by tweet id hash ("id") or not at all ("none") (default: id)')
+	argp.add_argument('--limit',type=int,default=None,help='stop after this many tweets')
+	argp.add_argument('--clock',action='store_true',help='write the replay clock to the store, for spark-output.py --replay')
+	args = argp.parse_args()
+
+	paths = []
+	for pattern in args.files:
+		paths.extend(sorted(glob.glob(pattern)) or [pattern])
+	speed = None if args.speed == 'max' else float(args.speed)
+	if args.clock and speed is None:
+		argp.error('--clock needs a paced replay, not --speed max')
+
+	clock = {}
+	def started(start,first):
+		clock.update(start=start,first=first)
+		write_clock(start,first,speed)
+
+	# a replay can't lose anything to a full queue, so put() waits for the sender instead of dropping
+	key = tweet_key if args.key == 'id' else None
+	producer = AsyncProducer(args.kafka,topic=args.topic,codec=args.codec,put_timeout=None,key=key,doPrint=True)
+	start = time.time()
+	ct = replay(read_lines(paths),producer,speed,limit=args.limit,on_first=started if args.clock else None)
+	producer.close(timeout=None)
+	if clock:
+		# everything has reached Kafka now, batches after this aren't part of the replay
+		write_clock(clock['start'],clock['first'],speed,end=time.time())
+	print 'replayed {} tweets from {} files in {:.1f}s'.format(ct,len(paths),time.time()-start)
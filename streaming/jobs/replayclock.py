@@ -0,0 +1,61 @@
+''' The clock of a replay (replay-in.py), so spark-output.py --replay can store replayed batches
+	under the original debate time instead of the time of the replay.
+'''
+
+import time
+from datetime import datetime
+from storage import get_store
+
+_cache = {} # batch epoch -> original epoch (or None), so a batch's output operations read the clock once
+
+
+def write_clock(start,first,speed,end=None,store=None,domain_name='replay'):
+	''' Stores the replay clock: the replay started sending at epoch start with the tweet created
+		at epoch first, at speed times the original pace. end is when it sent its last tweet. '''
+	if store is None:
+		store = get_store()
+	attrs = [{'Name':'start', 'Value':repr(float(start)), 'Replace':True},
+			 {'Name':'first', 'Value':repr(float(first)), 'Replace':True},
+			 {'Name':'speed', 'Value':repr(float(speed)), 'Replace':True},
+			 {'Name':'end',	  'Value':repr(float(end)) if end is not None else '', 'Replace':True}]
+	store.put_items(domain_name,[('clock',attrs)])
+
+
+def load_clock(store=None,domain_name='replay'):
+	''' Returns the last replay's clock as a dict (start, first, speed, end), or None '''
+	if store is None:
+		store = get_store()
+	attrs = store.select_all(domain_name).get('clock')
+	if attrs is None:
+		return None
+	a = dict((attr['Name'],attr['Value']) for attr in attrs)
+	return {'start': float(a['start']),
+			'first': float(a['first']),
+			'speed': float(a['speed']),
+			'end':	 float(a['end']) if a.get('end') else None}
+
+
+def original_time(epoch,clock,interval):
+	''' Maps the DStream batch time epoch to the original time of the tweets it carries, or
+		returns None if the batch isn't part of the replay. A batch covers what was sent up to its
+		batch time, so the replay's last tweets are in the first batch at or after clock['end']. '''
+	if clock is None or epoch < clock['start']:
+		return None
+	if clock['end'] is not None and epoch >= clock['end'] + interval:
+		return None
+	return clock['first'] + (epoch - clock['start']) * clock['speed']
+
+
+def replay_batch_time(batch_time,interval,store=None):
+	''' batch_time (a DStream batch time, a local datetime) moved to the original debate time if
+		the batch is part of a replay, otherwise batch_time unchanged. The clock is read from the
+		store once per batch. '''
+	epoch = time.mktime(batch_time.timetuple())
+	if epoch not in _cache:
+		for old in [t for t in _cache if t < epoch - 10*interval]:
+			del _cache[old]
+		_cache[epoch] = original_time(epoch,load_clock(store),interval)
+	original = _cache[epoch]
+	if original is None:
+		return batch_time
+	return datetime.fromtimestamp(original)
@@ -0,0 +1,114 @@
+''' Batched writes to AWS SimpleDB: 25-item batch_put_attributes calls through one client per
+	executor process (see SDBWriter).
+'''
+
+import time
+
+MAX_BATCH_SIZE = 25 # SimpleDB won't take more than 25 items per BatchPutAttributes call
+
+# SDB says ServiceUnavailable (HTTP 503) when it throttles us, the others are there just in case
+THROTTLE_CODES = ('ServiceUnavailable','Throttling','ThrottlingException','RequestThrottled')
+
+_clients = {}
+
+def get_sdb_client(region_name='us-east-1'):
+	''' Returns a boto3 sdb client, created once per (executor) process and region.
+
+		NOTE: Keep the boto3 import local! We ran into issues with a global boto3 import in
+			  functions that run on the child nodes (see write_to_db in utils.py). '''
+	client = _clients.get(region_name)
+	if client is None:
+		import boto3 # keep local boto import!
+		client = _clients[region_name] = boto3.client('sdb', region_name=region_name)
+	return client
+
+
+def is_throttled(e):
+	''' True if e is a botocore ClientError for SDB throttling us '''
+	response = getattr(e,'response',None) or {}
+	return response.get('Error',{}).get('Code') in THROTTLE_CODES
+
+
+class SDBWriter(object):
+	''' Buffers SDB items and writes them with batch_put_attributes.
+
+		Usage:
+			writer = SDBWriter('tweets')
+			for item_name, attrs in items:
+				writer.put(item_name, attrs)
+			writer.close() # flushes whatever is left, returns throughput stats
+
+		attrs is the same list of {'Name','Value','Replace'} dicts that put_attributes takes.
+		Putting the same item name twice before a flush merges the attributes, since SDB rejects
+		duplicate item names within one batch. Throttled batches are retried up to max_retries
+		times with exponential backoff, starting at backoff seconds. '''
+
+	def __init__(self,domain_name,client=None,batch_size=MAX_BATCH_SIZE,max_retries=5,backoff=0.5,doPrint=False):
+		self.domain_name = domain_name
+		self.client      = client if client is not None else get_sdb_client()
+		self.batch_size  = min(batch_size,MAX_BATCH_SIZE)
+		self.max_retries = max_retries
+		self.backoff     = backoff
+		self.doPrint     = doPrint
+		self.pending     = []
+		self.pending_idx = {}
+
+		self.items_written = 0
+		self.items_failed  = 0
+		self.batches       = 0
+		self.retries       = 0
+		self.seconds       = 0.0
+
+	def put(self,item_name,attrs):
+		''' Queues one item, flushing once we have a full batch '''
+		item_name = str(item_name)
+		if item_name in self.pending_idx:
+			self.pending[self.pending_idx[item_name]]['Attributes'].extend(attrs)
+			return
+		self.pending_idx[item_name] = len(self.pending)
+		self.pending.append( {'Name':item_name,'Attributes':list(attrs)} )
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		''' Sends everything queued so far as one batch_put_attributes call '''
+		if len(self.pending) == 0:
+			return
+		items = self.pending
+		self.pending     = []
+		self.pending_idx = {}
+
+		start = time.time()
+		for attempt in range(self.max_retries+1):
+			try:
+				self.client.batch_put_attributes(DomainName=self.domain_name, Items=items)
+				self.items_written += len(items)
+				break
+			except Exception, e:
+				if is_throttled(e) and attempt < self.max_retries:
+					self.retries += 1
+					time.sleep(self.backoff * 2**attempt)
+					continue
+				print 'sdb batch write error ({} items): {}'.format(len(items),str(e))
+				self.items_failed += len(items)
+				break
+		self.batches += 1
+		self.seconds += time.time() - start
+
+	def close(self):
+		''' Flushes the last (partial) batch and returns the throughput stats '''
+		self.flush()
+		stats = self.stats()
+		if self.doPrint:
+			print 'sdb writes to {domain}: {items} items in {batches} batches, {failed} failed, {retries} retries, {rate:.1f} items/sec'.format(**stats)
+		return stats
+
+	def stats(self):
+		return {'domain':  self.domain_name,
+				'items':   self.items_written,
+				'failed':  self.items_failed,
+				'batches': self.batches,
+				'retries': self.retries,
+				'seconds': self.seconds,
+				'rate':    self.items_written/self.seconds if self.seconds > 0 else 0.0
+			   }
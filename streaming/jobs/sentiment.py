@@ -8,20 +8,61 @@ from os.path import expanduser
     Took out the HTML/PDF functions
     Added standard deviation output to emotion() '''
 
-def emotionFileReader(stopval=1.0,lang="english",min=1.0,max=9.0,returnVector=False):
+def labMTFileFetcher(bucket_name='cs205-final-project',key_name='scripts/labmt.txt',cache_dir=None):
+  """Return the raw labMT file, from a local disk cache if it is still current.
+
+  The cached copy lives in cache_dir (default ~/.labmt) next to the ETag it was downloaded with.
+  We only do a HEAD request to compare ETags, and only download the file again if it changed on s3.
+  If s3 can't be reached at all, we fall back to whatever is in the cache."""
+
+  if cache_dir is None:
+    cache_dir = os.path.join(expanduser("~"),'.labmt')
+  local_path = os.path.join(cache_dir,os.path.basename(key_name))
+  etag_path  = local_path + '.etag'
+
+  cached_etag = None
+  if os.path.exists(local_path) and os.path.exists(etag_path):
+    with open(etag_path) as fp:
+      cached_etag = fp.read().strip()
+
+  try:
+    obj  = boto3.resource('s3').Object(bucket_name,key_name)
+    etag = obj.e_tag # HEAD request, doesn't pull down the body
+  except Exception, e:
+    if cached_etag is None:
+      raise
+    etag = cached_etag
+
+  if etag == cached_etag:
+    with open(local_path) as fp:
+      return fp.read()
+
+  body = obj.get()['Body'].read()
+  try:
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    with open(local_path,'w') as fp:
+      fp.write(body)
+    with open(etag_path,'w') as fp:
+      fp.write(etag)
+  except (IOError, OSError), e:
+    print 'could not cache labMT file: {}'.format(str(e))
+  return body
+
+def emotionFileReader(stopval=1.0,lang="english",min=1.0,max=9.0,returnVector=False,cache_dir=None):
   """Load the dictionary of sentiment words.
   
   Stopval is our lens, $\Delta _h$, read the labMT dataset into a dict with this lens (must be tab-deliminated).
 
+  The file itself comes from labMTFileFetcher, so it's only downloaded from s3 when it has changed.
+  Load this once on the driver and ship it to executors with sc.broadcast() (see spark-output.py).
+
   With returnVector = True, returns tmpDict,tmpList,wordList. Otherwise, just the dictionary."""
 
   labMT1flag = False
   scoreIndex = 1 # second value
 
-  s3 = boto3.resource('s3')
-  bucket_name  = 'cs205-final-project'
-  key_name  = 'scripts/labmt.txt'
-  f = s3.Object(bucket_name,key_name).get()['Body'].read().split('\n')
+  f = labMTFileFetcher(cache_dir=cache_dir).split('\n')
   # skip the first line
   f = f[1:]
 
@@ -84,3 +125,98 @@ def emotion(tmpStr,someDict,scoreIndex=1,shift=False,happsList=[],return_scores=
 
 
 
+
+
+wordPattern    = re.compile(r"[\w\@\#\'\&\]\*\-\/\[\=\;]+",flags=re.UNICODE)
+replaceStrings = ['---','--','\'\'']
+
+class EmotionScorer(object):
+  """Vectorized emotion() for a whole batch of texts.
+
+  Tokenizes the batch (same rules as emotion()) into a CSR document-term matrix over the labMT
+  vocabulary, so scoring the batch is a few sparse matrix-vector products instead of a Python loop
+  and np.mean/np.std per tweet.
+
+  Build it once from the emotionFileReader() dict, eg. with getScorer() on the executors."""
+
+  def __init__(self,someDict,scoreIndex=1):
+    words = sorted(someDict.keys())
+    self.index  = dict((word,i) for i,word in enumerate(words))
+    self.scores = np.array([float(someDict[word][scoreIndex]) for word in words])
+    self.scoresSquared = self.scores**2
+
+  def documentTermMatrix(self,texts):
+    """Returns (CSR matrix of labMT word counts, one row per text; total word count per text)."""
+    from scipy.sparse import csr_matrix
+
+    index   = self.index
+    indices = []
+    indptr  = [0]
+    totals  = np.empty(len(texts))
+
+    for i,tmpStr in enumerate(texts):
+      totals[i] = len(tmpStr.split(" "))
+      for replaceString in replaceStrings:
+        tmpStr = tmpStr.replace(replaceString,' ')
+      for word in wordPattern.findall(tmpStr):
+        j = index.get(word.lower())
+        if j is not None:
+          indices.append(j)
+      indptr.append(len(indices))
+
+    dtm = csr_matrix((np.ones(len(indices)),indices,indptr),shape=(len(texts),len(self.scores)))
+    return dtm, totals
+
+  def wordStats(self,texts):
+    """Returns per-text arrays (number of scored words, sum of scores, sum of squared scores, total words)."""
+    dtm, totals = self.documentTermMatrix(texts)
+    counts = np.asarray(dtm.sum(axis=1)).ravel()
+    sums   = dtm.dot(self.scores)
+    sumsSquared = dtm.dot(self.scoresSquared)
+    return counts, sums, sumsSquared, totals
+
+  def score(self,texts):
+    """Returns per-text arrays (happs_avg, happs_std, prop_words_used).
+
+    Same numbers as emotion() gives one text at a time, except texts with no labMT words
+    get NaN instead of None."""
+    counts, sums, sumsSquared, totals = self.wordStats(texts)
+    with np.errstate(divide='ignore',invalid='ignore'):
+      happs_avg = sums/counts
+      happs_std = np.sqrt(np.maximum(sumsSquared/counts - happs_avg**2, 0.0))
+    happs_std[counts == 0] = np.nan
+    return happs_avg, happs_std, counts/totals
+
+def getScorer(labMT):
+  """Returns an EmotionScorer for the broadcast labMT dict, built once per executor process.
+
+  Python workers keep broadcast objects around between tasks, so we just hang the scorer off it."""
+  scorer = getattr(labMT,'_scorer',None)
+  if scorer is None:
+    scorer = labMT._scorer = EmotionScorer(labMT.value)
+  return scorer
+
+def emotionStats(count=0,total=0.0,totalSquared=0.0,happs_avg=None):
+  """Mergeable sentiment summary: (count, sum, sum of squares, min, max).
+
+  count/sum/sum of squares are over scored labMT words (EmotionScorer.wordStats gives these per
+  tweet), so merging them gives exactly the average and std that emotion() would give for all
+  the tweets glued together into one string. min and max are over per-tweet happs_avg.
+
+  Called with no arguments, returns the empty summary (the zero value for aggregations)."""
+  if happs_avg is None or happs_avg != happs_avg: # None or NaN
+    return (int(count), float(total), float(totalSquared), float('inf'), float('-inf'))
+  return (int(count), float(total), float(totalSquared), float(happs_avg), float(happs_avg))
+
+def mergeEmotionStats(a,b):
+  """Combines two emotionStats summaries. Works as both seqOp and combOp for
+  aggregateByKey/treeAggregate, as long as the values are emotionStats summaries too."""
+  return (a[0]+b[0], a[1]+b[1], a[2]+b[2], min(a[3],b[3]), max(a[4],b[4]))
+
+def emotionStatsSummary(stats):
+  """Returns (happs_avg, happs_std) for an emotionStats summary, (None, None) if it has no words."""
+  count, total, totalSquared = stats[0], stats[1], stats[2]
+  if count == 0:
+    return (None, None)
+  happs_avg = total/count
+  return (happs_avg, np.sqrt(max(totalSquared/count - happs_avg**2, 0.0)))
@@ -1,6 +1,10 @@
 from utils import *
+from ratecontrol import streaming_conf, report_lag
+from dedup import dedup_stream, report_dedup
+from metrics import getMetricsInstance, note_metrics, export_batch
+from replayclock import replay_batch_time
 from os.path import expanduser
-import boto3
+import boto3, sys
 
 s3res  		 = boto3.resource('s3')
 bucket_name  = 'cs205-final-project'
@@ -38,6 +42,14 @@ party_of_debate = settings['Topic_Tracked']['val']
 BATCH_DURATION = int(settings['Batch_Duration']['val'])
 # how many minutes should the stream stay open?
 STREAM_DURATION = int(settings['Stream_Duration']['val'])
+# partitions in the Kafka tweets topic (see start-kafka-topic.sh). The direct stream reads each one in its
+# own task, and ingest keeps that partitioning all the way to the per-candidate reduce
+KAFKA_PARTITIONS = int(settings['Kafka_Partitions']['val']) if 'Kafka_Partitions' in settings else 8
+# tweet ids remembered per dedup shard (x2, see dedup.py), there's one shard per Kafka partition
+DEDUP_CAPACITY = int(settings['Dedup_Capacity']['val']) if 'Dedup_Capacity' in settings else 200000
+# per-batch metrics (see metrics.py) go to a JSON lines file, and to http://<driver>:port/metrics if a port is set
+METRICS_FILE = settings['Metrics_File']['val'] if 'Metrics_File' in settings else '/tmp/gauging-debate-metrics.jsonl'
+METRICS_PORT = int(settings['Metrics_Port']['val']) if 'Metrics_Port' in settings else None
 
 
 import pyspark
@@ -46,38 +58,166 @@ from pyspark.streaming import StreamingContext
 		  We have the .jar saved in the main directory on both EMR clusters and /git-local, its name is:
 			spark-streaming-kafka-assembly_2.10-1.5.2.jar
 		  This needs to be added to the spark-submit call using the --jars flag. See run-main.sh '''
-from pyspark.streaming.kafka import KafkaUtils
-
-sc = pyspark.SparkContext()
-ssc = StreamingContext(sc, BATCH_DURATION) # second arg is num seconds per DStream-RDD
-
-quiet_logs(sc)
-
-#time = set_end_time()
-#old time code: timesup = datetime.datetime(year,month,day,hour,minute).strftime('%s')
-#				while int(timesup) > time.time():
-
-# create kafka streaming context
-kstream = KafkaUtils.createDirectStream(ssc, ["tweets"], {"bootstrap.servers": kafka_host})
+from pyspark.streaming.kafka import KafkaUtils, TopicAndPartition
+
+# windowed and cumulative state (reduceByKeyAndWindow, updateStateByKey) and Kafka offsets are
+# checkpointed here. Use HDFS (or s3) on the cluster, so a new driver can pick it up.
+if 'Checkpoint_Dir' in settings:
+	checkpoint_dir = settings['Checkpoint_Dir']['val']
+elif on_cluster:
+	checkpoint_dir = 'hdfs:///user/hadoop/checkpoints'
+else:
+	checkpoint_dir = '/tmp/gauging-debate-checkpoints'
+
+''' Recovery after a driver restart:
+		* default: StreamingContext.getOrCreate() restores the whole DStream graph from the checkpoint,
+		  including Kafka offsets and rolling window state, and re-runs any unfinished batches.
+		* fast recovery (spark-submit ... spark-output.py --fast-recovery): skip the checkpoint, start a
+		  fresh context and resume Kafka from the last offsets committed to the store (see
+		  commit_offsets in utils.py). Rolling windows start over, but we're back up right away.
+	Result writes all use Replace=True and deterministic item names: tweets by tweet id, sentiment
+	by candidate, batchtime and Kafka offsets, rolling, lag and dedup rows by batchtime.
+		* checkpoint recovery re-runs a batch with the same batch time and offsets, so the re-run
+		  overwrites whatever the first attempt wrote.
+		* fast recovery is only at-least-once for the batch that was in flight at the crash: it gets
+		  read again from the last committed offsets, but under a new batchtime (and maybe a longer
+		  offset range), so any sentiment, rolling, lag or dedup rows it had already written stay next
+		  to the new ones. Tweets don't double, they're keyed by id. '''
+FAST_RECOVERY = '--fast-recovery' in sys.argv
+# rebuilding an old debate with replay-in.py --clock: store replayed batches under the original tweet time
+REPLAY = '--replay' in sys.argv
 
 # Load nested JSON of search terms
 jdata = get_search_json(bucket_name,terms_key)
 
 # Collect all search terms in JSON into search_terms list
 search_terms = pool_search_terms(jdata)
+# Compile the search terms once here, the matcher gets shipped to executors with the ingest closure
+matcher = TermMatcher(search_terms,jdata['candidates'][party_of_debate])
+
+# SDB unless GD_STORAGE says otherwise (eg. GD_STORAGE=sqlite for a single-box run), see storage.py
+store = get_store()
+
+
+def batchtime_of(t):
+	''' get_batchtime for DStream batch time t. With --replay, batches that are part of a replay
+		(see replayclock.py) get the batchtime of the original tweets instead. '''
+	if REPLAY:
+		t = replay_batch_time(t,BATCH_DURATION,store)
+	return get_batchtime(t,BATCH_DURATION)
+
+
+def create_context(from_offsets=None):
+	''' Builds the StreamingContext and the whole DStream graph.
+		getOrCreate() only calls this if there's no checkpoint to recover from. '''
+
+	# backpressure and the per-partition Kafka ingest cap, see ratecontrol.py
+	sc = pyspark.SparkContext(conf=pyspark.SparkConf().setAll(streaming_conf(settings)))
+	ssc = StreamingContext(sc, BATCH_DURATION) # second arg is num seconds per DStream-RDD
+	ssc.checkpoint(checkpoint_dir)
+
+	#time = set_end_time()
+	#old time code: timesup = datetime.datetime(year,month,day,hour,minute).strftime('%s')
+	#				while int(timesup) > time.time():
+
+	# create kafka streaming context
+	if from_offsets:
+		kstream = KafkaUtils.createDirectStream(ssc, ["tweets"], {"bootstrap.servers": kafka_host},
+												fromOffsets=from_offsets)
+	else:
+		kstream = KafkaUtils.createDirectStream(ssc, ["tweets"], {"bootstrap.servers": kafka_host})
+
+	# first output operation: note the batch's Kafka offsets, see record_offsets in utils.py.
+	# Output operations run for every batch, including the ones re-run after a checkpoint restore,
+	# and in order, so the offsets are there for everything registered after this.
+	kstream.foreachRDD(record_offsets)
+
+	def ingest(batch_time,rdd):
+		''' decode_tweet -> filter_tweets -> get_relevant_fields, all in one pass per partition.
+			batchtime is computed once here on the driver for the whole micro-batch. '''
+		batchtime = batchtime_of(batch_time)
+		metrics = getMetricsInstance(rdd.context)
+		return rdd.mapPartitions(lambda part: ingest_partition(part,matcher,batchtime,metrics=metrics))
+
+	filtered = kstream.transform(ingest)
+
+	# drop tweets we've already seen (Twitter resends some after reconnects), see dedup.py
+	deduped, dedup_stats = dedup_stream(filtered,KAFKA_PARTITIONS,DEDUP_CAPACITY,
+										checkpoint_interval=10*BATCH_DURATION)
+	deduped = deduped.cache()
+	dedup_stats.foreachRDD(lambda t, rdd: note_metrics(batchtime_of(t),
+													   report_dedup(rdd,batchtime_of(t),store),'dedup.'))
+
+	# writes individual tweets to sdb domain: tweets
+	def write_tweets(rdd):
+		metrics = getMetricsInstance(rdd.context)
+		rdd.foreachPartition(lambda part: write_to_db(part,store=store,metrics=metrics))
+
+	deduped.foreachRDD(write_tweets)
+	# per-candidate summaries for each batch, scored once and shared by the per-batch and rolling outputs
+	# default settings remove words scored 4-6 on the scale (too neutral). 
+	# adjust with kwarg stopval, determines 'ignore spread' out from 5. eg. default stopval = 1.0 (4-6)
+	# labMT is loaded once per driver (from the local disk cache if s3 hasn't changed), then broadcast.
+	# It's fetched lazily, since broadcasts can't be restored from a checkpoint
+	summaries = (deduped.transform(lambda rdd: summarize_batch(rdd,getLabMTInstance(rdd.context),
+															   metrics=getMetricsInstance(rdd.context)))
+						 .cache()
+				)
+	# writes analysis output (sentiment, lda) to sdb doman: sentiment
+	def analyze(t,rdd):
+		start = time.time()
+		process(rdd,jdata,party_of_debate,batchtime_of(t),store,offsets=get_offsets(t))
+		note_metrics(batchtime_of(t),{'seconds':time.time()-start},'process.')
+
+	summaries.foreachRDD(analyze)
+
+	''' Rolling sentiment: 1-minute and 5-minute windows, plus cumulative for the whole debate.
+		Each batch adds its stats and the inverse function subtracts the batch that slid out of the
+		window, so the cost per batch stays constant however long the debate runs.
+		Window lengths have to be multiples of BATCH_DURATION. '''
+	batch_stats = summaries.mapValues(window_stats)
+
+	def rolling_window(name,seconds):
+		seconds = BATCH_DURATION * max(1, seconds // BATCH_DURATION)
+		return (batch_stats.reduceByKeyAndWindow(add_window_stats, subtract_window_stats, seconds, BATCH_DURATION,
+												 filterFunc=lambda kv: kv[1][0] > 0) # drop candidates that left the window
+						   .mapValues(lambda ws: (name, ws))
+			   )
+
+	cumulative = (batch_stats.updateStateByKey(update_cumulative)
+							 .mapValues(lambda ws: ('cumulative', ws))
+				 )
+
+	rolling = rolling_window('window_1m',60).union(rolling_window('window_5m',300)).union(cumulative)
+	# writes rolling series to sdb domain: rolling
+	rolling.foreachRDD(lambda t, rdd: write_rolling(rdd,batchtime_of(t),store))
+
+	# measure how long the batch took and how far behind real time we are, writes to sdb domain: lag
+	filtered.foreachRDD(lambda t, rdd: note_metrics(batchtime_of(t),
+													report_lag(time.mktime(t.timetuple()),get_batch_records(t),BATCH_DURATION,store),'lag.'))
+	# all of this batch's writes are done, so commit its Kafka offsets
+	filtered.foreachRDD(lambda t, rdd: commit_offsets(t,store))
+	# last output operation: every stage has counted into the metrics accumulator, export the batch
+	filtered.foreachRDD(lambda t, rdd: export_batch(rdd.context,batchtime_of(t),
+													METRICS_FILE,METRICS_PORT))
+
+	return ssc
+
+
+if FAST_RECOVERY:
+	committed = load_committed_offsets("tweets",store)
+	''' fromOffsets decides which partitions the stream reads, so every partition needs an entry.
+		A partition that never got a commit starts from the beginning (the topic is created fresh
+		with each cluster, so offset 0 is still there). That includes all of them when nothing was
+		committed yet: without fromOffsets the direct stream would start at the latest offsets and
+		skip everything produced since the crash. '''
+	partitions = set(range(KAFKA_PARTITIONS)) | set(committed)
+	from_offsets = dict((TopicAndPartition("tweets",p),committed.get(p,0)) for p in partitions)
+	ssc = create_context(from_offsets)
+else:
+	ssc = StreamingContext.getOrCreate(checkpoint_dir, create_context)
 
-filtered = (kstream.map(lambda data: make_json(data,BATCH_DURATION)) 
-				.filter(lambda tweet: filter_tweets(tweet[1],search_terms))
-				.map(lambda tweet: get_relevant_fields(tweet,jdata,party_of_debate))
-				.cache()
-		   )
-
-# writes individual tweets to sdb domain: tweets
-filtered.foreachRDD(lambda rdd: rdd.foreachPartition(write_to_db))
-# writes analysis output (sentiment, lda) to sdb doman: sentiment
-filtered.foreachRDD(lambda rdd: process(rdd,jdata,party_of_debate))
-
+quiet_logs(ssc.sparkContext)
 
 ssc.start()
 ssc.awaitTermination() # we should figure out how to set a termination marker (NOV 26)
-
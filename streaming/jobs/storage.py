@@ -0,0 +1,144 @@
+''' Storage backends for tweets and per-batch results: AWS SimpleDB (SDBStore) or a local SQLite
+	file (SQLiteStore), picked by get_store().
+'''
+
+import os, sqlite3, threading
+from sdbwriter import SDBWriter, get_sdb_client
+
+
+class Store(object):
+	''' Interface every storage backend implements.
+
+		The data model is SimpleDB's, since that's what the front-end already consumes: a domain
+		(table) holds items, and an item is a name plus a list of {'Name','Value'} attributes (names
+		can repeat). put_items() takes (item_name, attrs) pairs with put_attributes-style attrs
+		({'Name','Value','Replace'}), reads return {item_name: [{'Name','Value'}, ...]}.
+
+		Stores only hold configuration, so they're safe to ship to executors. '''
+
+	def put_items(self,domain,items):
+		''' Bulk write of (item_name, attrs) pairs. Returns write stats (a dict). '''
+		raise NotImplementedError
+
+	def select_all(self,domain):
+		''' Returns every item in domain as {item_name: attrs} '''
+		raise NotImplementedError
+
+	def select_range(self,domain,start,end=None,candidate=None):
+		''' Returns items whose timestamp attribute is between start and end (inclusive),
+			or equal to start if end is None. If candidate is given, only items whose candidate
+			attribute matches. Timestamps are compared as strings, like SDB does. '''
+		raise NotImplementedError
+
+
+class SDBStore(Store):
+
+	def __init__(self,region_name='us-east-1',doPrint=False):
+		self.region_name = region_name
+		self.doPrint     = doPrint
+
+	def put_items(self,domain,items):
+		writer = SDBWriter(domain,client=get_sdb_client(self.region_name),doPrint=self.doPrint)
+		for item_name, attrs in items:
+			writer.put(item_name,attrs)
+		return writer.close()
+
+	def _select(self,query):
+		paginator = get_sdb_client(self.region_name).get_paginator('select')
+		output = {}
+		for r in paginator.paginate( SelectExpression=query, ConsistentRead=True ):
+			for row in r.get('Items',[]):
+				output[str(row['Name'])] = row['Attributes']
+		return output
+
+	def select_all(self,domain):
+		return self._select("select * from {}".format(domain))
+
+	def select_range(self,domain,start,end=None,candidate=None):
+		if end is not None:
+			query = 'SELECT * FROM {} WHERE timestamp BETWEEN "{}" AND "{}"'.format(domain,start,end)
+		else:
+			query = 'SELECT * FROM {} WHERE timestamp="{}"'.format(domain,start)
+		if candidate is not None:
+			query += ' AND candidate="{}"'.format(candidate)
+		return self._select(query)
+
+
+''' sqlite3 connections can't be shared between threads (the streaming job's output threads and
+	Flask's request threads all go through the one store object), so we keep one per thread and path. '''
+_connections = threading.local()
+
+class SQLiteStore(Store):
+	''' One attributes table for all domains, one row per (item, attribute name, value),
+		with indexes for the timestamp range and candidate lookups.
+		Each thread opens its own connection, so on a real cluster every node would write its own
+		file: use it with local Spark. '''
+
+	def __init__(self,path='gauging-debate.db',doPrint=False):
+		self.path    = os.path.abspath(os.path.expanduser(path))
+		self.doPrint = doPrint
+
+	def _connect(self):
+		''' One connection per thread and path, created on first use (so executors make their own) '''
+		conns = _connections.__dict__
+		conn  = conns.get(self.path)
+		if conn is None:
+			conn = conns[self.path] = sqlite3.connect(self.path)
+			conn.execute('PRAGMA journal_mode=WAL')
+			conn.execute('PRAGMA synchronous=NORMAL')
+			conn.execute('''CREATE TABLE IF NOT EXISTS attributes
+							(domain TEXT, item TEXT, name TEXT, value TEXT,
+							 UNIQUE (domain, item, name, value))''')
+			conn.execute('CREATE INDEX IF NOT EXISTS attr_lookup ON attributes (domain, name, value)')
+			conn.commit()
+		return conn
+
+	def put_items(self,domain,items):
+		conn = self._connect()
+		ct   = 0
+		with conn: # one transaction for the whole bulk write
+			for item_name, attrs in items:
+				item_name = str(item_name)
+				for a in attrs:
+					if a.get('Replace',False):
+						conn.execute('DELETE FROM attributes WHERE domain=? AND item=? AND name=?',
+									 (domain,item_name,a['Name']))
+				# SDB ignores exact duplicate name/value pairs too
+				conn.executemany('INSERT OR IGNORE INTO attributes VALUES (?,?,?,?)',
+								 [(domain,item_name,a['Name'],a['Value']) for a in attrs])
+				ct += 1
+		return {'domain':domain, 'items':ct}
+
+	def _items(self,domain,where='',args=()):
+		query = 'SELECT item, name, value FROM attributes WHERE domain=?' + where + ' ORDER BY rowid'
+		output = {}
+		for item, name, value in self._connect().execute(query,(domain,)+tuple(args)):
+			output.setdefault(str(item),[]).append( {'Name':name,'Value':value} )
+		return output
+
+	def select_all(self,domain):
+		return self._items(domain)
+
+	def select_range(self,domain,start,end=None,candidate=None):
+		if end is not None:
+			where = " AND item IN (SELECT item FROM attributes WHERE domain=? AND name='timestamp' AND value BETWEEN ? AND ?)"
+			args  = [domain,str(start),str(end)]
+		else:
+			where = " AND item IN (SELECT item FROM attributes WHERE domain=? AND name='timestamp' AND value=?)"
+			args  = [domain,str(start)]
+		if candidate is not None:
+			where += " AND item IN (SELECT item FROM attributes WHERE domain=? AND name='candidate' AND value=?)"
+			args  += [domain,candidate]
+		return self._items(domain,where,args)
+
+
+def get_store(backend=None,path=None,**kwargs):
+	''' Returns the configured Store. backend is 'sdb' or 'sqlite', defaulting to the
+		GD_STORAGE environment variable (or 'sdb'). path is the SQLite file, defaulting to
+		GD_STORAGE_PATH (or ./gauging-debate.db). '''
+	backend = backend or os.environ.get('GD_STORAGE','sdb')
+	if backend == 'sdb':
+		return SDBStore(**kwargs)
+	elif backend == 'sqlite':
+		return SQLiteStore(path or os.environ.get('GD_STORAGE_PATH','gauging-debate.db'),**kwargs)
+	raise ValueError('unknown storage backend: {}'.format(backend))
@@ -0,0 +1,82 @@
+''' Tests for the Bloom filters in dedup.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, pickle, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from dedup import BloomFilter, RotatingBloomFilter, dedup_shard, dedup_update
+
+
+class BloomFilterTest(unittest.TestCase):
+
+	def test_no_false_negatives(self):
+		bloom = BloomFilter(1000,0.01)
+		for i in range(1000):
+			bloom.add(i)
+		self.assertTrue(all(i in bloom for i in range(1000)))
+
+	def test_false_positive_rate(self):
+		bloom = BloomFilter(10000,0.01)
+		for i in range(10000):
+			bloom.add(i)
+		false_positives = sum(1 for i in range(10000,30000) if i in bloom)
+		self.assertLess(false_positives / 20000.0,0.02)
+		self.assertLess(bloom.estimated_fp_rate(),0.02)
+
+	def test_pickles(self):
+		bloom = BloomFilter(100)
+		bloom.add('663000000000000000')
+		copy = pickle.loads(pickle.dumps(bloom,2))
+		self.assertTrue('663000000000000000' in copy)
+		self.assertEqual(copy.count,1)
+
+
+class RotatingBloomFilterTest(unittest.TestCase):
+
+	def test_seen(self):
+		bloom = RotatingBloomFilter(100)
+		self.assertFalse(bloom.seen('a'))
+		self.assertTrue(bloom.seen('a'))
+
+	def test_rotation(self):
+		ids	  = [663000000000000000 + i*7919 for i in range(300)]
+		bloom = RotatingBloomFilter(100,0.001)
+		for i in ids[:100]:
+			self.assertFalse(bloom.seen(i))
+		self.assertEqual(bloom.rotations,0)
+		bloom.seen(ids[100]) # current is full: it becomes previous
+		self.assertEqual(bloom.rotations,1)
+		self.assertTrue(bloom.seen(ids[0])) # still remembered by the previous generation
+		self.assertTrue(bloom.seen(ids[100]))
+		for i in ids[101:201]:
+			self.assertFalse(bloom.seen(i))
+		self.assertEqual(bloom.rotations,2) # the first generation is gone now
+		self.assertFalse(bloom.seen(ids[5]))
+		self.assertTrue(bloom.seen(ids[150]))
+		self.assertEqual(bloom.size(),2 * bloom.current.size())
+
+
+class DedupUpdateTest(unittest.TestCase):
+
+	def test_batches(self):
+		state = dedup_update([(1,'a'),(2,'b'),(1,'a again')],None,capacity=100)
+		self.assertEqual(state[1],[(1,'a'),(2,'b')])
+		self.assertEqual(state[2]['records'],3)
+		self.assertEqual(state[2]['duplicates'],1)
+
+		state = dedup_update([(2,'b resent'),(3,'c')],state,capacity=100)
+		self.assertEqual(state[1],[(3,'c')])
+		self.assertEqual(state[2]['duplicates'],1)
+
+		# an empty batch keeps the filter
+		empty = dedup_update([],state,capacity=100)
+		self.assertTrue(empty[0] is state[0])
+		self.assertEqual(empty[1],[])
+
+	def test_shards(self):
+		self.assertEqual(dedup_shard(663000000000000000,8),dedup_shard('663000000000000000',8))
+		self.assertEqual(set(dedup_shard(i,8) for i in range(1000)),set(range(8)))
+
+
+if __name__ == '__main__':
+	unittest.main()
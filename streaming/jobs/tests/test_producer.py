@@ -0,0 +1,136 @@
+''' Tests for producer.py, against a stub Kafka client. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, json, shutil, tempfile, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+try:
+	import kafka
+except ImportError:
+	kafka = None
+
+from producer import AsyncProducer, SpillBuffer, tweet_key
+
+
+class StubClient(object):
+	''' Just enough of KafkaClient for a synchronous producer: topic metadata, and produce
+		requests recorded as (topic, partition, [payloads]) instead of sent. '''
+
+	def __init__(self,partition_ids=(0,1,2,3),fail=False):
+		self.partition_ids = list(partition_ids)
+		self.fail		   = fail
+		self.sent		   = []
+
+	def load_metadata_for_topics(self,*topics):
+		pass
+
+	def has_metadata_for_topic(self,topic):
+		return True
+
+	def get_partition_ids_for_topic(self,topic):
+		return self.partition_ids
+
+	def send_produce_request(self,payloads=[],acks=1,timeout=1000,fail_on_error=True,callback=None):
+		if self.fail:
+			raise IOError('kafka is down')
+		for req in payloads:
+			self.sent.append( (req.topic,req.partition,[m.value for m in req.messages]) )
+		return []
+
+
+def tweet_line(i):
+	return json.dumps({'id':663000000000000000 + i*7919,'text':'tweet {}'.format(i)},separators=(',',':'))
+
+
+@unittest.skipIf(kafka is None,'kafka-python not installed')
+class AsyncProducerTest(unittest.TestCase):
+
+	def make(self,client,**kwargs):
+		return AsyncProducer('stub:9092',codec='none',linger=0.05,backoff=0.01,client=client,**kwargs)
+
+	def test_keyed_batches_go_to_their_partitions(self):
+		client	 = StubClient(partition_ids=[3,1,0,2])
+		producer = self.make(client,key=tweet_key)
+		lines	 = [tweet_line(i) for i in range(200)]
+		for line in lines:
+			producer.put(line)
+		stats = producer.close()
+
+		self.assertEqual(stats['sent'],200)
+		self.assertEqual(stats['failed'],0)
+		self.assertEqual(stats['spilled'],0)
+		received = {}
+		for topic, partition, payloads in client.sent:
+			self.assertEqual(topic,'tweets')
+			for p in payloads:
+				received[p] = partition
+		self.assertEqual(sorted(received),sorted(lines))
+		for line in lines:
+			self.assertEqual(received[line],[0,1,2,3][tweet_key(line) % 4])
+		self.assertEqual(len(set(received.values())),4) # spread over all of them
+
+	def test_unkeyed(self):
+		client	 = StubClient()
+		producer = self.make(client)
+		for i in range(10):
+			producer.put(tweet_line(i))
+		self.assertEqual(producer.close()['sent'],10)
+		self.assertEqual(sum(len(p) for t, part, p in client.sent),10)
+
+	def test_failed_batches_spill(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			client	 = StubClient(fail=True)
+			producer = self.make(client,key=tweet_key,max_retries=1,spill=os.path.join(tmp,'spill.txt'))
+			for i in range(20):
+				producer.put(tweet_line(i))
+			stats = producer.close()
+			self.assertEqual(stats['sent'],0)
+			self.assertEqual(stats['spilled'],20)
+			with open(os.path.join(tmp,'spill.txt')) as f:
+				self.assertEqual(f.read().splitlines(),[tweet_line(i) for i in range(20)])
+		finally:
+			shutil.rmtree(tmp)
+
+
+class TweetKeyTest(unittest.TestCase):
+
+	def test_key_is_stable_and_from_the_tweet_id(self):
+		line = '{"created_at":"x","id":663000000000000123,"user":{"id":42}}'
+		self.assertEqual(tweet_key(line),tweet_key('{"id":663000000000000123}'))
+		self.assertNotEqual(tweet_key(line),tweet_key('{"id":663000000000000124}'))
+		self.assertEqual(tweet_key('{"limit":{"track":5}}'),0)
+
+
+class SpillBufferTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir   = tempfile.mkdtemp()
+		self.spill = SpillBuffer(os.path.join(self.dir,'spill.txt'))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_drain(self):
+		self.spill.append(['a','b','c'])
+		self.assertTrue(self.spill.pending())
+		sent = []
+		self.assertEqual(self.spill.drain(sent.append,batch_size=2),3)
+		self.assertEqual(sent,[['a','b'],['c']])
+		self.assertFalse(self.spill.pending())
+
+	def test_failed_drain_keeps_the_rest(self):
+		self.spill.append(['a','b','c','d','e'])
+		calls = []
+		def send(batch):
+			calls.append(batch)
+			if len(calls) == 2:
+				raise IOError('down again')
+		self.assertRaises(IOError,self.spill.drain,send,2)
+		sent = []
+		self.assertEqual(self.spill.drain(sent.append,batch_size=10),3)
+		self.assertEqual(sent,[['c','d','e']])
+
+
+if __name__ == '__main__':
+	unittest.main()
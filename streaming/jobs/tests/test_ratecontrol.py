@@ -0,0 +1,51 @@
+''' Tests for the lag report in ratecontrol.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from ratecontrol import LagEstimator, streaming_conf
+
+
+class LagEstimatorTest(unittest.TestCase):
+
+	def test_keeping_up(self):
+		le = LagEstimator(30)
+		stats = le.update(1000,3000,finished=1010)
+		self.assertEqual(stats['processing_time'],10)
+		self.assertEqual(stats['scheduling_delay'],0)
+		self.assertEqual(stats['lag'],10)
+		self.assertEqual(stats['estimated_rate'],300)
+		self.assertEqual(stats['behind'],0)
+		self.assertEqual(stats['suggested_batch'],30)
+
+	def test_falling_behind(self):
+		le = LagEstimator(30)
+		le.update(1000,6000,finished=1040)				  # 40s for a 30s batch
+		stats = le.update(1030,6000,finished=1080)		  # waited 10s for the one before
+		self.assertEqual(stats['scheduling_delay'],10)
+		self.assertEqual(stats['processing_time'],40)
+		self.assertEqual(stats['lag'],50)
+		self.assertEqual(stats['behind'],2)
+		self.assertEqual(stats['suggested_batch'],50)	  # 40s at 80% utilization
+		self.assertAlmostEqual(stats['estimated_rate'],150)
+
+	def test_smoothing(self):
+		le = LagEstimator(30,smoothing=0.5)
+		le.update(1000,3000,finished=1010) # 300/s
+		stats = le.update(1030,1000,finished=1040) # 100/s
+		self.assertAlmostEqual(stats['estimated_rate'],200)
+
+
+class StreamingConfTest(unittest.TestCase):
+
+	def test_conf(self):
+		conf = dict(streaming_conf({}))
+		self.assertEqual(conf['spark.streaming.backpressure.enabled'],'true')
+		self.assertEqual(conf['spark.streaming.kafka.maxRatePerPartition'],'2000')
+		conf = dict(streaming_conf({'Max_Rate_Per_Partition': {'val': '500'}}))
+		self.assertEqual(conf['spark.streaming.kafka.maxRatePerPartition'],'500')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,50 @@
+''' Tests for replayclock.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, shutil, tempfile, unittest
+from datetime import datetime
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from storage import SQLiteStore
+import replayclock
+from replayclock import write_clock, load_clock, original_time, replay_batch_time
+
+START = 1450000000.0 # when the replay started sending
+FIRST = 1442448000.0 # the original time of its first tweet
+
+
+class ReplayClockTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir   = tempfile.mkdtemp()
+		self.store = SQLiteStore(os.path.join(self.dir,'test.db'))
+		replayclock._cache.clear()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_round_trip(self):
+		self.assertIsNone(load_clock(self.store))
+		write_clock(START,FIRST,10,store=self.store)
+		self.assertEqual(load_clock(self.store),{'start':START,'first':FIRST,'speed':10.0,'end':None})
+		write_clock(START,FIRST,10,end=START+600,store=self.store)
+		self.assertEqual(load_clock(self.store)['end'],START+600)
+
+	def test_original_time(self):
+		clock = {'start':START,'first':FIRST,'speed':10.0,'end':START+600}
+		self.assertEqual(original_time(START+30,clock,30),FIRST+300)
+		self.assertIsNone(original_time(START-30,clock,30))
+		# the first batch at or after the end still carries the last tweets, the next one doesn't
+		self.assertEqual(original_time(START+620,clock,30),FIRST+6200)
+		self.assertIsNone(original_time(START+630,clock,30))
+
+	def test_replay_batch_time(self):
+		before = datetime.fromtimestamp(START-60)
+		self.assertEqual(replay_batch_time(before,30,self.store),before)
+		write_clock(START,FIRST,1,store=self.store)
+		self.assertEqual(replay_batch_time(datetime.fromtimestamp(START+90),30,self.store),datetime.fromtimestamp(FIRST+90))
+		self.assertEqual(replay_batch_time(datetime.fromtimestamp(START-30),30,self.store),datetime.fromtimestamp(START-30))
+
+
+if __name__ == '__main__':
+	unittest.main()
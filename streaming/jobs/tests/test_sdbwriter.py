@@ -0,0 +1,104 @@
+''' Tests for SDBWriter in sdbwriter.py, against a stub sdb client. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import sdbwriter
+from sdbwriter import SDBWriter, MAX_BATCH_SIZE
+
+
+class StubError(Exception):
+	''' Looks like a botocore ClientError as far as is_throttled is concerned '''
+
+	def __init__(self,code):
+		Exception.__init__(self,code)
+		self.response = {'Error': {'Code': code}}
+
+
+class StubClient(object):
+	''' Records batch_put_attributes calls. errors is a list of exceptions to raise, one per call,
+		before the calls start going through. '''
+
+	def __init__(self,errors=()):
+		self.errors	 = list(errors)
+		self.calls	 = []
+		self.batches = []
+
+	def batch_put_attributes(self,DomainName,Items):
+		self.calls.append( (DomainName,[item['Name'] for item in Items]) )
+		if self.errors:
+			raise self.errors.pop(0)
+		self.batches.append( (DomainName,Items) )
+
+
+def attrs(value):
+	return [{'Name':'data','Value':value,'Replace':True}]
+
+
+class SDBWriterTest(unittest.TestCase):
+
+	def setUp(self):
+		# record the backoff instead of waiting it out
+		self.sleeps = []
+		self.sleep	= sdbwriter.time.sleep
+		sdbwriter.time.sleep = self.sleeps.append
+
+	def tearDown(self):
+		sdbwriter.time.sleep = self.sleep
+
+	def write(self,client,names,**kwargs):
+		writer = SDBWriter('tweets',client=client,backoff=0.5,**kwargs)
+		for name in names:
+			writer.put(name,attrs(str(name)))
+		return writer.close()
+
+	def test_batches_of_25(self):
+		client = StubClient()
+		stats = self.write(client,range(60))
+		self.assertEqual([len(names) for domain, names in client.calls],[25,25,10])
+		self.assertEqual([domain for domain, names in client.calls],['tweets']*3)
+		self.assertEqual((stats['items'],stats['batches'],stats['failed'],stats['retries']),(60,3,0,0))
+
+	def test_batch_size_is_capped(self):
+		client = StubClient()
+		self.write(client,range(60),batch_size=100)
+		self.assertEqual(max(len(names) for domain, names in client.calls),MAX_BATCH_SIZE)
+
+	def test_duplicate_names_merge(self):
+		client = StubClient()
+		writer = SDBWriter('tweets',client=client)
+		writer.put('a',attrs('1'))
+		writer.put('b',attrs('2'))
+		writer.put('a',[{'Name':'more','Value':'3','Replace':True}])
+		stats = writer.close()
+		items = client.batches[0][1]
+		self.assertEqual([item['Name'] for item in items],['a','b'])
+		self.assertEqual([a['Name'] for a in items[0]['Attributes']],['data','more'])
+		self.assertEqual(stats['items'],2)
+
+	def test_throttled_batches_are_retried_with_backoff(self):
+		client = StubClient([StubError('ServiceUnavailable'),StubError('Throttling')])
+		stats = self.write(client,range(10))
+		self.assertEqual(len(client.calls),3)
+		self.assertEqual(self.sleeps,[0.5,1.0])
+		self.assertEqual((stats['items'],stats['failed'],stats['retries'],stats['batches']),(10,0,2,1))
+
+	def test_gives_up_after_max_retries(self):
+		client = StubClient([StubError('ServiceUnavailable')]*4)
+		stats = self.write(client,range(10),max_retries=3)
+		self.assertEqual(len(client.calls),4)
+		self.assertEqual(self.sleeps,[0.5,1.0,2.0])
+		self.assertEqual((stats['items'],stats['failed'],stats['retries']),(0,10,3))
+
+	def test_other_errors_fail_the_batch(self):
+		# not retried, counted as failed, and the next batch still goes out
+		client = StubClient([StubError('InvalidParameterValue')])
+		stats = self.write(client,range(30))
+		self.assertEqual(self.sleeps,[])
+		self.assertEqual([len(names) for domain, names in client.calls],[25,5])
+		self.assertEqual((stats['items'],stats['failed'],stats['retries'],stats['batches']),(5,25,0,2))
+
+
+if __name__ == '__main__':
+	unittest.main()
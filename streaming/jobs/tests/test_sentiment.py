@@ -0,0 +1,49 @@
+''' Tests for the vectorized scorer in sentiment.py against the one-text-at-a-time emotion().
+	Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, unittest
+import numpy as np
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from sentiment import emotion, EmotionScorer, emotionStats, mergeEmotionStats, emotionStatsSummary
+
+# labMT-shaped: word -> [rank, happs, ...]
+LABMT = {'love': ['1','8.42'], 'happy': ['2','8.30'], 'hate': ['3','2.34'], 'war': ['4','1.80'],
+		 "don't": ['5','3.70'], '#winning': ['6','7.10'], 'sad': ['7','2.38']}
+
+TEXTS = ['I love this, so happy',
+		 'hate hate HATE the war',
+		 "don't be sad -- we're #winning",
+		 'nothing scored here at all',
+		 'Love--war', # the '--' gets split like in emotion()
+		 'happy']
+
+
+class EmotionScorerTest(unittest.TestCase):
+
+	def test_matches_emotion(self):
+		avg, std, used = EmotionScorer(LABMT).score(TEXTS)
+		for i, text in enumerate(TEXTS):
+			happs_avg, happs_std, scores, words, unused, total, prop = emotion(text,LABMT,return_scores=True)
+			if happs_avg is None:
+				self.assertTrue(np.isnan(avg[i]) and np.isnan(std[i]))
+			else:
+				self.assertAlmostEqual(avg[i],happs_avg)
+				self.assertAlmostEqual(std[i],happs_std)
+			self.assertAlmostEqual(used[i],prop)
+
+	def test_merged_stats_match_joined_text(self):
+		counts, sums, squares, totals = EmotionScorer(LABMT).wordStats(TEXTS)
+		stats = emotionStats()
+		for i in range(len(TEXTS)):
+			stats = mergeEmotionStats(stats,emotionStats(counts[i],sums[i],squares[i],sums[i]/counts[i] if counts[i] else None))
+		happs_avg, happs_std = emotion(' '.join(TEXTS),LABMT)
+		avg, std = emotionStatsSummary(stats)
+		self.assertAlmostEqual(avg,happs_avg)
+		self.assertAlmostEqual(std,happs_std)
+		self.assertEqual(emotionStatsSummary(emotionStats()),(None,None))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+''' Tests for SQLiteStore in storage.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, shutil, tempfile, threading, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from storage import SQLiteStore
+
+
+def attrs(timestamp,candidate,data='x'):
+	return [{'Name':'timestamp','Value':timestamp,'Replace':True},
+			{'Name':'candidate','Value':candidate,'Replace':True},
+			{'Name':'data','Value':data,'Replace':True}]
+
+
+class SQLiteStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir   = tempfile.mkdtemp()
+		self.store = SQLiteStore(os.path.join(self.dir,'test.db'))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_put_and_select(self):
+		self.store.put_items('sentiment',[('a',attrs('100','trump')),('b',attrs('130','bush')),('c',attrs('160','trump'))])
+		self.assertEqual(sorted(self.store.select_all('sentiment')),['a','b','c'])
+		self.assertEqual(sorted(self.store.select_range('sentiment','100','130')),['a','b'])
+		self.assertEqual(sorted(self.store.select_range('sentiment','100','160',candidate='trump')),['a','c'])
+		self.assertEqual(sorted(self.store.select_range('sentiment','130')),['b'])
+		self.assertEqual(self.store.select_all('other'),{})
+
+	def test_replace(self):
+		self.store.put_items('sentiment',[('a',attrs('100','trump','old'))])
+		self.store.put_items('sentiment',[('a',attrs('100','trump','new'))])
+		data = [a['Value'] for a in self.store.select_all('sentiment')['a'] if a['Name'] == 'data']
+		self.assertEqual(data,['new'])
+
+	def test_threads(self):
+		# the streaming job's output threads and Flask's request threads share one store object
+		self.store.put_items('sentiment',[('a',attrs('100','trump'))])
+		errors = []
+		def work(i):
+			try:
+				self.store.put_items('sentiment',[('t{}'.format(i),attrs('200','bush'))])
+				self.store.select_all('sentiment')
+			except Exception, e:
+				errors.append(e)
+		threads = [threading.Thread(target=work,args=(i,)) for i in range(4)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		self.assertEqual(errors,[])
+		self.assertEqual(len(self.store.select_range('sentiment','200')),4)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+''' Tests for timeconv.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, unittest
+import numpy as np
+from datetime import datetime
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from timeconv import parse_twitter_time, parse_timestamp, twitter_time_to_str, convert_timezone, parse_column, convert_column, SQL_FORMAT
+
+
+class ParseTest(unittest.TestCase):
+
+	def test_twitter_format(self):
+		self.assertEqual(parse_twitter_time('Wed Sep 16 23:59:59 +0000 2015'),datetime(2015,9,16,23,59,59))
+		self.assertEqual(twitter_time_to_str('Tue Oct 13 01:02:03 +0000 2015'),'2015-10-13 01:02:03')
+
+	def test_sql_format(self):
+		self.assertEqual(parse_timestamp('2015-09-16 23:59:59'),datetime(2015,9,16,23,59,59))
+
+	def test_dateutil_fallback(self):
+		self.assertEqual(parse_twitter_time('2015-09-16T23:59:59'),datetime(2015,9,16,23,59,59))
+		self.assertEqual(parse_timestamp('16 Sep 2015 23:59:59'),datetime(2015,9,16,23,59,59))
+
+	def test_malformed_twitter_time_raises(self):
+		# same length and ' +0000' as created_at, but a bad month
+		for ts in ['Wed Foo 16 23:59:59 +0000 2015', 'garbage', '2015-13-45 99:99:99']:
+			self.assertRaises(ValueError,parse_timestamp,ts)
+			self.assertRaises(ValueError,parse_twitter_time,ts)
+
+
+class ConvertTest(unittest.TestCase):
+
+	def test_utc_to_new_york(self):
+		edt = convert_timezone('Wed Sep 16 23:59:59 +0000 2015')
+		self.assertEqual(edt.replace(tzinfo=None),datetime(2015,9,16,19,59,59))
+		est = convert_timezone(datetime(2015,12,19,12,0,0))
+		self.assertEqual(est.replace(tzinfo=None),datetime(2015,12,19,7,0,0))
+
+
+class ColumnTest(unittest.TestCase):
+
+	TIMES = ['Wed Sep 16 23:59:59 +0000 2015', u'Sun Dec 20 01:00:00 +0000 2015',
+			 'Sun Nov 01 05:30:00 +0000 2015', 'Sun Nov 01 06:30:00 +0000 2015', # either side of the DST change
+			 '2015-10-14 01:02:03', '16 Sep 2015 23:59:59', 'Thu Feb 29 12:00:00 +0000 2016']
+
+	def test_parse_matches_parse_timestamp(self):
+		got = parse_column(self.TIMES)
+		self.assertEqual(got.dtype,np.dtype('M8[s]'))
+		self.assertEqual([t.astype(datetime) for t in got],[parse_timestamp(t) for t in self.TIMES])
+
+	def test_convert_matches_convert_timezone(self):
+		want = [convert_timezone(t).strftime(SQL_FORMAT) for t in self.TIMES]
+		self.assertEqual(list(convert_column(self.TIMES)),want)
+		self.assertEqual(list(convert_column(self.TIMES,'America/New_York','UTC')),
+						 [convert_timezone(t,'America/New_York','UTC').strftime(SQL_FORMAT) for t in self.TIMES])
+
+	def test_empty(self):
+		self.assertEqual(len(convert_column([])),0)
+
+	def test_malformed_raises(self):
+		for ts in ['Mon Feb 30 01:00:00 +0000 2015', 'Wed Foo 16 23:59:59 +0000 2015', '2015-13-45 99:99:99']:
+			self.assertRaises(ValueError,convert_column,['Wed Sep 16 23:59:59 +0000 2015',ts])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,175 @@
+''' Tests for the ingest helpers in utils.py. Run from streaming/jobs:
+		python -m unittest discover tests '''
+
+import os, sys, unittest
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from utils import *
+
+
+CANDIDATES = {'clinton': ['clinton', 'hillary', 'hillaryclinton'],
+			  'sanders': ['sanders', 'bernie', 'feelthebern'],
+			  'omalley': ['omalley', 'martinomalley']}
+GENERAL	   = ['democraticdebate', 'debate']
+
+
+class TermMatcherTest(unittest.TestCase):
+
+	def setUp(self):
+		self.matcher = TermMatcher(GENERAL,CANDIDATES)
+
+	def test_no_match(self):
+		self.assertIsNone(self.matcher.scan('nothing to see here'))
+		self.assertIsNone(self.matcher.scan('xclinton is not a mention'))
+
+	def test_prefixes(self):
+		self.assertEqual(self.matcher.scan('Hillary tonight'),['clinton'])
+		self.assertEqual(self.matcher.scan('go #FeelTheBern'),['sanders'])
+		self.assertEqual(self.matcher.scan('hey @martinomalley'),['omalley'])
+
+	def test_candidates_in_order_of_mention(self):
+		self.assertEqual(self.matcher.scan('bernie and hillary and sanders again'),['sanders','clinton'])
+
+	def test_general(self):
+		self.assertEqual(self.matcher.scan('watching the #DemocraticDebate'),['general'])
+
+	def test_shared_term_tags_every_candidate(self):
+		matcher = TermMatcher([],{'jeb': ['bush', 'jeb'], 'george': ['bush', 'dubya']})
+		self.assertEqual(matcher.scan('a bush on stage'),['george','jeb'])
+		self.assertEqual(matcher.scan('jeb, then bush'),['jeb','george'])
+
+
+
+class RelevantFieldsTest(unittest.TestCase):
+
+	def tweet(self,created_at):
+		return {'id': 1, 'created_at': created_at, 'text': u'hillary #debate',
+				'user': {'screen_name': 'someone'}, 'entities': {'hashtags': [{'text': u'debate'}]}}
+
+	def test_fields(self):
+		t = get_relevant_fields(('1442448000',self.tweet('Wed Sep 16 23:59:59 +0000 2015'),['clinton']))
+		self.assertEqual(t.timestamp,'2015-09-16 23:59:59')
+		self.assertEqual(t.search_terms,['clinton'])
+		self.assertEqual(t.hashtags,['debate'])
+
+	def test_bad_created_at_drops_the_tweet(self):
+		self.assertIsNone(get_relevant_fields(('1442448000',self.tweet('Wed Foo 16 23:59:59 +0000 2015'),['clinton'])))
+
+
+class StubAccumulator(object):
+	''' Stands in for the metrics accumulator, Counters only ever calls add() '''
+
+	def __init__(self):
+		self.value = {}
+
+	def add(self,values):
+		for k, v in values.items():
+			self.value[k] = self.value.get(k,0) + v
+
+
+class IngestPartitionTest(unittest.TestCase):
+
+	def line(self,**changes):
+		tweet = {'id': 1, 'created_at': 'Wed Sep 16 23:59:59 +0000 2015', 'text': u'hillary #debate',
+				 'lang': 'en', 'user': {'screen_name': 'someone'}, 'entities': {'urls': [], 'hashtags': []}}
+		tweet.update(changes)
+		return json.dumps(tweet,separators=(',',':'))
+
+	def test_drops_by_reason(self):
+		lines = [self.line(),
+				 '{"delete":{"status":{"id":1}}}',
+				 self.line(retweeted_status={'id': 2}),
+				 self.line(lang='fr'),
+				 self.line(entities={'urls': [{'url': 'http://t.co/x'}], 'hashtags': []}),
+				 self.line(text=u'nothing about anyone'),
+				 '{"id":1,"lang":"en", not json',
+				 self.line(created_at='Wed Foo 16 23:59:59 +0000 2015')]
+		metrics = StubAccumulator()
+		matcher = TermMatcher(GENERAL,CANDIDATES)
+		out = list(ingest_partition([(None,l) for l in lines],matcher,'1442448000',metrics=metrics))
+		self.assertEqual([t.search_terms for t in out],[['clinton']])
+		m = metrics.value
+		self.assertEqual((m['ingest.records'],m['ingest.out']),(8,1))
+		for reason in ['delete','retweet','lang','links','no_match','decode','fields']:
+			self.assertEqual(m['drop.'+reason],1,reason)
+		self.assertNotIn('drop.filter',m)
+
+	def test_timed_before_yielding(self):
+		# everything is counted and flushed by the time the first record comes out
+		metrics = StubAccumulator()
+		records = ingest_partition([(None,self.line())]*3,TermMatcher(GENERAL,CANDIDATES),'1442448000',metrics=metrics)
+		next(records)
+		self.assertEqual(metrics.value['ingest.out'],3)
+		self.assertIn('ingest.seconds',metrics.value)
+
+
+# labMT-shaped: word -> [rank, happs, ...]
+LABMT = {'love': ['1','8.42'], 'happy': ['2','8.30'], 'hate': ['3','2.34'], 'war': ['4','1.80'],
+		 'sad': ['5','2.38'], 'win': ['6','7.10']}
+
+
+class TweetColumnsTest(unittest.TestCase):
+
+	TWEETS = [('clinton', u'love love happy'),
+			  ('sanders', u'hate the war'),
+			  ('clinton', u'nothing scored here'),
+			  ('sanders', u'happy to win'),
+			  ('clinton', u'sad war'),
+			  ('omalley', u'no words at all'),
+			  ('sanders', u'love and war')]
+
+	def setUp(self):
+		self.scorer = EmotionScorer(LABMT)
+		self.tweets = [Tweet(i, '1442448000', '2015-09-16 23:59:59', 'someone', text, [], [name])
+					   for i, (name, text) in enumerate(self.TWEETS)]
+
+	def one_tweet(self,text):
+		# the summary of a single tweet, which the column summaries should be a merge of
+		counts, sums, squares, totals = self.scorer.wordStats([text])
+		stats = emotionStats(counts[0], sums[0], squares[0], sums[0]/counts[0] if counts[0] else None)
+		happs_avg = emotionStatsSummary(stats)[0]
+		if happs_avg is None:
+			return (1, 0, stats, None, None)
+		return (1, 1, stats, (happs_avg, text), (happs_avg, text))
+
+	def assertSummaryEqual(self,got,want):
+		self.assertEqual(got[:2],want[:2])
+		self.assertEqual(got[2][0],want[2][0])
+		for g, w in zip(got[2][1:],want[2][1:]):
+			self.assertAlmostEqual(g,w)
+		for g, w in zip(got[3:],want[3:]):
+			if w is None:
+				self.assertIsNone(g)
+			else:
+				self.assertAlmostEqual(g[0],w[0])
+				self.assertEqual(g[1],w[1])
+
+	def test_summaries_match_merged_tweets(self):
+		want = {}
+		for t in self.tweets:
+			s = self.one_tweet(t.text)
+			want[t.first_term] = merge_summaries(want[t.first_term],s) if t.first_term in want else s
+		got = dict(TweetColumns(self.tweets).score(self.scorer).summaries())
+		self.assertEqual(sorted(got.keys()),['clinton','omalley','sanders'])
+		for name in want:
+			self.assertSummaryEqual(got[name],want[name])
+
+	def test_highest_and_lowest(self):
+		got = dict(TweetColumns(self.tweets).score(self.scorer).summaries())
+		self.assertEqual(got['clinton'][3][1],u'love love happy')
+		self.assertEqual(got['clinton'][4][1],u'sad war')
+		self.assertEqual(got['clinton'][:2],(3,2))
+		self.assertEqual(got['omalley'][:2],(1,0))
+		self.assertIsNone(got['omalley'][3])
+
+	def test_partitions_merge(self):
+		# two partitions reduced with merge_summaries give the same as one partition
+		whole = dict(TweetColumns(self.tweets).score(self.scorer).summaries())
+		parts = [dict(TweetColumns(p).score(self.scorer).summaries()) for p in (self.tweets[:3], self.tweets[3:])]
+		for name in whole:
+			ss = [p[name] for p in parts if name in p]
+			self.assertSummaryEqual(reduce(merge_summaries,ss),whole[name])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,171 @@
+''' Timestamp parsing and timezone conversion, shared by the streaming job (utils.py) and the
+	archive jobs (misc/reduce-archive.py, misc/get-hist-sep16.py, LDA/). Zones are cached per
+	process, and convert_column() converts a whole column of timestamps at once with numpy.
+
+	Note: This needs to sit next to whatever imports it (/home/hadoop/scripts on the cluster), and
+		  Spark jobs that convert on executors should ship it with sc.addPyFile().
+'''
+
+from datetime import datetime
+from dateutil import parser, tz
+import numpy as np
+
+DEBATE_TZ 	   = 'America/New_York' # the time zone of the debates
+TWITTER_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+SQL_FORMAT     = '%Y-%m-%d %H:%M:%S'
+
+MONTHS = {'Jan':1, 'Feb':2, 'Mar':3, 'Apr':4,  'May':5,  'Jun':6,
+		  'Jul':7, 'Aug':8, 'Sep':9, 'Oct':10, 'Nov':11, 'Dec':12}
+
+_zones = {}
+
+def get_tz(name):
+	''' Returns tzinfo for name, resolving it only the first time we see it in this process '''
+	zone = _zones.get(name)
+	if zone is None:
+		zone = _zones[name] = tz.gettz(name)
+	return zone
+
+
+def _slice_twitter_time(ts):
+	''' 'Wed Sep 16 23:59:59 +0000 2015' -> naive datetime. Raises if ts isn't in that format. '''
+	return datetime(int(ts[26:30]), MONTHS[ts[4:7]], int(ts[8:10]),
+					int(ts[11:13]), int(ts[14:16]), int(ts[17:19]))
+
+
+def _parse_other(ts):
+	''' dateutil fallback for anything we can't slice. Raises ValueError if it can't be parsed. '''
+	try:
+		return parser.parse(ts).replace(tzinfo=None)
+	except (ValueError, OverflowError, TypeError, AttributeError), e:
+		raise ValueError('unparseable timestamp {!r}: {}'.format(ts,str(e)))
+
+
+def parse_twitter_time(ts):
+	''' Parses a Twitter created_at string into a naive UTC datetime.
+
+		created_at is always 'Wed Sep 16 23:59:59 +0000 2015', so we can just slice it up.
+		Anything that doesn't look like that goes straight to dateutil. Raises ValueError if that
+		can't make sense of it either. '''
+	try:
+		return _slice_twitter_time(ts)
+	except (KeyError, ValueError, TypeError):
+		return _parse_other(ts)
+
+
+def parse_timestamp(ts):
+	''' Parses either a Twitter created_at string or a '%Y-%m-%d %H:%M:%S' string, with a
+		dateutil fallback for anything else. Returns a naive datetime, raises ValueError. '''
+	if len(ts) == 19 and ts[4] == '-' and ts[10] == ' ':
+		try:
+			return datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+							int(ts[11:13]), int(ts[14:16]), int(ts[17:19]))
+		except ValueError:
+			return _parse_other(ts)
+	return parse_twitter_time(ts)
+
+
+def twitter_time_to_str(ts,fmt=SQL_FORMAT):
+	''' Reformats a Twitter created_at string, eg. to the '%Y-%m-%d %H:%M:%S' we store in SDB '''
+	return parse_twitter_time(ts).strftime(fmt)
+
+
+def convert_timezone(ts,from_zone='UTC',to_zone=DEBATE_TZ):
+	''' Converts ts (a datetime or a timestamp string) from from_zone to to_zone.
+		Naive datetimes are taken to be in from_zone. Returns an aware datetime. '''
+	if not isinstance(ts,datetime):
+		ts = parse_timestamp(ts)
+	if ts.tzinfo is None:
+		ts = ts.replace(tzinfo=get_tz(from_zone))
+	return ts.astimezone(get_tz(to_zone))
+
+
+# byte offsets of the year, month name, day, hour, minute and second in each fixed format
+_TWITTER_FIELDS = (slice(26,30), slice(4,7), slice(8,10), slice(11,13), slice(14,16), slice(17,19))
+_SQL_FIELDS		= (slice(0,4),	 slice(5,7), slice(8,10), slice(11,13), slice(14,16), slice(17,19))
+# month names as 3-byte integers, sorted for searchsorted, and the month number of each
+_MONTH_KEYS, _MONTH_NUMS = map(np.array, zip(*sorted(((ord(m[0])<<16) + (ord(m[1])<<8) + ord(m[2]), n)
+													 for m, n in MONTHS.items())))
+
+
+def _digits(chars,where):
+	''' The numbers in columns where of a (rows x bytes) uint8 array, and whether they were all digits '''
+	d = chars[:,where].astype(np.int64) - ord('0')
+	ok = ((d >= 0) & (d <= 9)).all(axis=1)
+	return (d * 10**np.arange(d.shape[1]-1,-1,-1)).sum(axis=1), ok
+
+
+def _slice_column(chars,fields,named_month):
+	''' Slices year..second out of every row of chars. Returns datetime64[s] and a mask of the
+		rows that really were in this format. '''
+	years, ok = _digits(chars,fields[0])
+	if named_month:
+		m = chars[:,fields[1]].astype(np.int64)
+		key = (m[:,0]<<16) + (m[:,1]<<8) + m[:,2]
+		at = np.minimum(np.searchsorted(_MONTH_KEYS,key), len(_MONTH_KEYS)-1)
+		ok &= _MONTH_KEYS[at] == key
+		months = _MONTH_NUMS[at]
+	else:
+		months, mok = _digits(chars,fields[1])
+		ok &= mok & (months >= 1) & (months <= 12)
+	parts = [years, months]
+	for f in fields[2:]:
+		v, vok = _digits(chars,f)
+		parts.append(v)
+		ok &= vok
+	days, hours, minutes, seconds = parts[2:]
+	ok &= (days >= 1) & (days <= 31) & (hours < 24) & (minutes < 60) & (seconds < 60)
+	months = np.where(ok, months, 1)
+	dates = ((np.where(ok, years, 1970) - 1970).astype('M8[Y]') + (months - 1).astype('m8[M]')).astype('M8[D]')
+	dates = dates + (days - 1).astype('m8[D]')
+	# a day that's past the end of its month rolls over, so it wasn't a real date
+	ok &= dates.astype('M8[M]').astype(np.int64) == (np.where(ok, years, 1970) - 1970)*12 + months - 1
+	return dates.astype('M8[s]') + (hours*3600 + minutes*60 + seconds).astype('m8[s]'), ok
+
+
+def parse_column(timestamps):
+	''' Parses a whole column of timestamps at once into a numpy datetime64[s] array (naive,
+		like parse_timestamp).
+
+		Twitter created_at strings and '%Y-%m-%d %H:%M:%S' strings are sliced up as byte arrays,
+		so the whole column is a handful of numpy operations. Anything in some other format goes
+		through parse_timestamp one at a time, and raises ValueError the same way. '''
+	ts = [t.encode('ascii','replace') if isinstance(t,unicode) else t for t in timestamps]
+	out = np.empty(len(ts), dtype='M8[s]')
+	if len(ts) == 0:
+		return out
+	raw = np.array(ts, dtype='S31') # one byte longer than created_at, so longer strings can't pass
+	lengths = np.char.str_len(raw)
+	chars = raw.view(np.uint8).reshape(len(ts), 31)
+	done = np.zeros(len(ts), dtype=bool)
+	for length, fields, named_month in ((30, _TWITTER_FIELDS, True), (19, _SQL_FIELDS, False)):
+		rows = np.flatnonzero(lengths == length)
+		if len(rows) == 0:
+			continue
+		parsed, ok = _slice_column(chars[rows],fields,named_month)
+		out[rows[ok]] = parsed[ok]
+		done[rows[ok]] = True
+	for i in np.flatnonzero(~done):
+		out[i] = np.datetime64(parse_timestamp(ts[i]),'s')
+	return out
+
+
+def convert_column(timestamps,from_zone='UTC',to_zone=DEBATE_TZ,as_strings=True):
+	''' Column version of convert_timezone, for the archive jobs: converts a whole list of
+		timestamps (see parse_column) from from_zone to to_zone, and returns them as an array of
+		'%Y-%m-%d %H:%M:%S' strings, or with as_strings=False, as naive datetime64[s].
+
+		The offset between the zones is looked up (with the cached get_tz zones) once per distinct
+		hour in the column rather than once per tweet, so this assumes zone changes happen on the
+		hour, which is true for the US zones we use. '''
+	times = parse_column(timestamps)
+	hours, which = np.unique(times.astype('M8[h]'), return_inverse=True)
+	offsets = np.empty(len(hours), dtype='m8[s]')
+	for i, h in enumerate(hours.astype('M8[s]').astype(np.int64)):
+		naive = datetime.utcfromtimestamp(h)
+		local = convert_timezone(naive,from_zone,to_zone).replace(tzinfo=None)
+		offsets[i] = np.timedelta64(int((local - naive).total_seconds()),'s')
+	local = times + offsets[which]
+	if not as_strings:
+		return local
+	return np.char.replace(np.datetime_as_string(local, unit='s'), 'T', ' ')
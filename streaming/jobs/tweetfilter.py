@@ -0,0 +1,124 @@
+''' Tweet filtering that doesn't need Spark, shared by the producer's Prefilter (twitter-in.py)
+	and the streaming job (utils.py).
+'''
+
+import json
+
+
+def raw_reason(raw):
+	''' Cheap checks on the raw (undecoded) Kafka line, so that most of what filter_tweets would
+		throw away never gets parsed at all. Returns None if the line passes, otherwise the reason
+		it gets dropped (the same reasons keep_tweet gives). Rejects:
+			* delete and limit notices (they start with {"delete" / {"limit")
+			* retweets (a "retweeted_status": key anywhere in the line)
+			* anything that isn't tagged "lang":"en" somewhere
+
+		Twitter's JSON has no whitespace between keys and values, and quotes inside strings are
+		escaped, so these substrings can only show up as real keys. Everything here errs on the side
+		of letting a tweet through (eg. the user object has a "lang" too), filter_tweets still runs
+		the exact checks on whatever is left. '''
+	if raw.startswith('{"delete"'):
+		return 'delete'
+	if raw.startswith('{"limit"'):
+		return 'limit'
+	if '"retweeted_status":' in raw:
+		return 'retweet'
+	if '"lang":"en"' not in raw:
+		return 'lang'
+	return None
+
+
+def prefilter_raw(raw):
+	''' True if the raw line passes raw_reason '''
+	return raw_reason(raw) is None
+
+
+def project_tweet(tweet):
+	''' Keeps only the fields filter_tweets and get_relevant_fields look at, in the same nested
+		shape, so the big user/entities/place objects get dropped right after decoding. '''
+	entities  = tweet['entities']
+	projected = {"id":         tweet['id'],
+				 "created_at": tweet['created_at'],
+				 "text":       tweet['text'],
+				 "lang":       tweet.get('lang'),
+				 "user":       {"screen_name": tweet['user']['screen_name']},
+				 "entities":   {"urls":     entities['urls'],
+								"hashtags": [{"text": el['text']} for el in entities['hashtags']]}
+				}
+	if 'media' in entities:
+		projected['entities']['media'] = entities['media']
+	return projected
+
+
+def keep_tweet(tweet):
+	''' The checks filter_tweets makes before it looks for search terms. Returns None if tweet
+		passes, otherwise the reason it gets dropped. '''
+	if not isinstance(tweet,dict):
+		return 'other'
+	if 'delete' in tweet:
+		return 'delete'
+	if 'limit' in tweet:
+		return 'limit'
+	if 'retweeted_status' in tweet:
+		return 'retweet'
+	if tweet.get('lang') != 'en':
+		return 'lang'
+	entities = tweet.get('entities') or {}
+	if len(entities.get('urls',[])) > 0 or 'media' in entities:
+		return 'links'
+	return None
+
+
+class Prefilter(object):
+	''' Drops the lines filter_tweets would drop anyway and strips the rest to the projected fields.
+
+		Usage:
+			prefilter = Prefilter()
+			line = prefilter(line) # None if the line was dropped
+			print prefilter.report()
+
+		Keeps count of lines and bytes in and out, and of drops per reason. '''
+
+	def __init__(self):
+		self.decode	   = json.JSONDecoder().decode
+		self.encode	   = json.JSONEncoder(separators=(',',':')).encode
+		self.lines_in  = 0
+		self.lines_out = 0
+		self.bytes_in  = 0
+		self.bytes_out = 0
+		self.dropped   = {}
+
+	def _drop(self,reason):
+		self.dropped[reason] = self.dropped.get(reason,0) + 1
+		return None
+
+	def __call__(self,raw):
+		self.lines_in += 1
+		self.bytes_in += len(raw)
+		# the raw checks catch deletes, limits and retweets without decoding anything
+		reason = raw_reason(raw)
+		if reason is not None:
+			return self._drop(reason)
+		try:
+			tweet = self.decode(raw.decode('utf-8'))
+		except ValueError:
+			return self._drop('error')
+		reason = keep_tweet(tweet)
+		if reason is not None:
+			return self._drop(reason)
+		try:
+			line = self.encode(project_tweet(tweet))
+		except (KeyError, TypeError):
+			return self._drop('error')
+		self.lines_out += 1
+		self.bytes_out += len(line)
+		return line
+
+	def reduction(self):
+		''' Fraction of the input bytes we didn't send '''
+		return 1.0 - float(self.bytes_out) / self.bytes_in if self.bytes_in > 0 else 0.0
+
+	def report(self):
+		return 'prefilter: {} of {} lines kept, {:.1f} MB -> {:.1f} MB ({:.1%} fewer bytes), dropped: {}'.format(
+			self.lines_out, self.lines_in, self.bytes_in/1e6, self.bytes_out/1e6, self.reduction(),
+			', '.join('{} {}'.format(n,reason) for reason,n in sorted(self.dropped.items())) or 'none')
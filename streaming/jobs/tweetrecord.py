@@ -0,0 +1,46 @@
+''' Tweet, the record a tweet travels through the streaming job as. '''
+
+from operator import itemgetter
+
+
+class Tweet(tuple):
+	''' (id, batchtime, timestamp, username, text, hashtags, search_terms)
+
+		A tuple subclass with no __dict__, so it costs no more than a tuple and pickles as a reference
+		to the class plus the bare values, without field names in every record. Fields are read by
+		name (tweet.text) or by position, and tweet[0] is the id, so anything that treats records as
+		(id, ...) pairs (eg. dedup.py) works. first_term and multiple_terms are worked out from
+		search_terms. '''
+
+	__slots__ = ()
+
+	FIELDS = ('id', 'batchtime', 'timestamp', 'username', 'text', 'hashtags', 'search_terms')
+
+	def __new__(cls,id,batchtime,timestamp,username,text,hashtags,search_terms):
+		return tuple.__new__(cls, (id, batchtime, timestamp, username, text, hashtags, search_terms))
+
+	def __getnewargs__(self):
+		return tuple(self)
+
+	id			 = property(itemgetter(0))
+	batchtime	 = property(itemgetter(1))
+	timestamp	 = property(itemgetter(2))
+	username	 = property(itemgetter(3))
+	text		 = property(itemgetter(4))
+	hashtags	 = property(itemgetter(5))
+	search_terms = property(itemgetter(6))
+
+	@property
+	def first_term(self):
+		return self[6][0]
+
+	@property
+	def multiple_terms(self):
+		return len(self[6]) > 1
+
+	def items(self):
+		''' (name, value) pairs for every field, including first_term and multiple_terms '''
+		return zip(self.FIELDS, self) + [('first_term', self.first_term), ('multiple_terms', self.multiple_terms)]
+
+	def __repr__(self):
+		return 'Tweet(' + ', '.join('{}={!r}'.format(k,v) for k,v in zip(self.FIELDS,self)) + ')'
@@ -1,7 +1,8 @@
 
-from kafka import SimpleProducer, KafkaClient
+from producer import AsyncProducer, tweet_key
+from twitterstream import stream_lines
+from tweetfilter import Prefilter
 from os.path import expanduser
-import requests
 from requests_oauthlib import OAuth1
 import urllib, datetime, time, json, sys, boto3
 import creds # we made this module for importing twitter api creds
@@ -56,8 +57,14 @@ else:
 kafka_port     = '9092'
 kafka_host = ':'.join([hostname,kafka_port])
 
-kafka = KafkaClient(kafka_host)
-producer = SimpleProducer(kafka)
+# batched, compressed sends from a background thread, so reading the Twitter stream never waits on Kafka
+# (see producer.py). Codec can be set with Kafka_Codec in bake-defaults.json: snappy, gzip, lz4 or none
+codec = settings['Kafka_Codec']['val'] if 'Kafka_Codec' in settings else 'snappy'
+# if Kafka is unreachable, tweets get spilled to this file and sent once it's back (next run, at the latest)
+spill_path = settings['Spill_Path']['val'] if 'Spill_Path' in settings else '~/tweets-spill.txt'
+# tweets are keyed by a hash of their id, to spread them over all of the topic's partitions (Kafka_Key: id or none)
+key = None if settings.get('Kafka_Key',{}).get('val') == 'none' else tweet_key
+producer = AsyncProducer(kafka_host,topic='tweets',codec=codec,spill=spill_path,key=key,doPrint=True)
 
 APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET = creds.get_twitter_creds()
 
@@ -77,8 +84,6 @@ search_terms = urllib.urlencode({"track":search_terms}).split("=")[1]
 # Query parameters to Twitter Stream API
 data      = [('language', 'en'), ('track', search_terms)]
 query_url = stream_url + '?' + '&'.join([str(t[0]) + '=' + str(t[1]) for t in data])
-# Use stream=True switch on requests.get() to pull in stream indefinitely
-response  = requests.get(query_url, auth=config_token, stream=True)
 
 
 def set_end_time(minutes_forward=minutes_forward):
@@ -102,52 +107,46 @@ def set_end_time(minutes_forward=minutes_forward):
 
 end_time = set_end_time()
 
-''' Twitter API returns a number of different status codes. 
-	We want status_code == 200.
-	See https://dev.twitter.com/streaming/overview/connecting for more.
-
-	NOTE: Twitter has 'etiquette' guidelines for how to handle 503, 401, etc. We should follow them!
-		  Right now we don't do anything about this, other than to report the error to stdout.
-'''
 print "END TIME:",end_time
 
-if response.status_code == 200:
-	print "Reponse Code = 200"
-	ct = 0
-	''' We will almost certainly not keep this code.
-
-		timesup just picks an end point (currently 2 minutes ahead) to stop ingesting tweets.
-		In production, we'd keep ingesting until either an error was thrown or the debate ended.
-
-		For that matter, we also need better error handling here, like how long to wait before 
-		reconnecting if the stream drops or rate limits out? 
-	'''
-	timesup = datetime.datetime(end_time['year'],
-								  end_time['month'],
-								  end_time['day'],
-								  end_time['hour'],
-								  end_time['minute']).strftime('%s')
-			  
-	for line in response.iter_lines():  # Iterate over streaming tweets
-		if int(timesup) > time.time():
-			#print(line.decode('utf8'))
-			try:
-				producer.send_messages('tweets', line)
-			except:
-				time.sleep(1)
-				producer.send_messages('tweets', line)
-			ct+=1
-		else:
-			break
-else:
-	print("ERROR Response code:{}".format(response.status_code))
-	try:
-		producer.send_messages('tweets', "ERROR Response code:{}".format(response.status_code))
-	except: 
-		time.sleep(1)
-		producer.send_messages('tweets', "ERROR Response code:{}".format(response.status_code))
+''' timesup just picks an end point (Stream_Duration minutes ahead) to stop ingesting tweets.
+	In production, we'd keep ingesting until the debate ended.
+
+	stream_lines() handles the connection: it reconnects with Twitter's recommended backoff when
+	the stream drops, stalls or returns an error code, and only gives up on errors that retrying
+	can't fix (eg. 401, bad credentials). See twitterstream.py. '''
+timesup = datetime.datetime(end_time['year'],
+							  end_time['month'],
+							  end_time['day'],
+							  end_time['hour'],
+							  end_time['minute']).strftime('%s')
+
+''' Optional prefilter (python twitter-in.py --prefilter, or Prefilter set to "on" in bake-defaults.json):
+	drops deletes, limit notices, retweets, non-English and link tweets here, and strips the rest down
+	to the fields spark-output.py uses, so they never take up Kafka disk and network. See tweetfilter.py. '''
+use_prefilter = ('--prefilter' in sys.argv) or (settings.get('Prefilter',{}).get('val') in ('on','true',True))
+prefilter = Prefilter() if use_prefilter else None
+REPORT_EVERY = 60 # seconds between prefilter reports
+last_report  = time.time()
+
+ct = 0
+for line in stream_lines(query_url, config_token, until=int(timesup)):  # Iterate over streaming tweets
+	#print(line.decode('utf8'))
+	if line: # skip keep-alive newlines
+		ct+=1
+		if prefilter is not None:
+			line = prefilter(line)
+			if time.time() - last_report >= REPORT_EVERY:
+				last_report = time.time()
+				print prefilter.report()
+			if line is None:
+				continue
+		producer.put(line)
+producer.close()
+print "tweets read:",ct
+if prefilter is not None:
+	print prefilter.report()
 print "END twitter-in.py"
-response.close()
 
 # restore duration default if changed
 #if minutes_forward != DURATION_DEFAULT:
@@ -0,0 +1,97 @@
+''' Reads the Twitter streaming API, reconnecting with Twitter's backoff rules (see stream_lines). '''
+
+import time, socket
+import requests
+
+NETWORK_BACKOFF = (0.25, 16)  # (step, max) seconds, linear
+HTTP_BACKOFF	= (5, 320)	  # (start, max) seconds, exponential
+RATE_BACKOFF	= (60, 960)	  # (start, max) seconds, exponential, for 420s
+FATAL_CODES		= (401, 403, 404, 406, 413, 416)
+
+# requests wraps most low-level errors, but a stalled read can still surface as a raw socket.timeout
+NETWORK_ERRORS = (requests.exceptions.RequestException, socket.error)
+
+
+class Backoff(object):
+	''' Keeps track of how long to wait before the next reconnect, per error class '''
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.network = 0.0
+		self.http	 = 0.0
+		self.rate	 = 0.0
+
+	def network_error(self):
+		step, most = NETWORK_BACKOFF
+		self.network = min(self.network + step, most)
+		return self.network
+
+	def http_error(self,status_code):
+		if status_code == 420:
+			start, most = RATE_BACKOFF
+			self.rate = min(self.rate * 2 if self.rate else start, most)
+			return self.rate
+		start, most = HTTP_BACKOFF
+		self.http = min(self.http * 2 if self.http else start, most)
+		return self.http
+
+
+def stream_lines(url,auth,until=None,stall_timeout=90,connect_timeout=10,doPrint=True):
+	''' Yields lines from the Twitter stream at url until the epoch time until (forever if None),
+		reconnecting whenever the connection drops, errors out or stalls.
+		Keep-alive newlines come through as empty strings.
+
+		Backoff follows https://dev.twitter.com/streaming/overview/connecting: linear from 250ms up
+		to 16s for network errors and stalls, exponential from 5s up to 320s for HTTP errors and
+		from 1 minute for 420s, and we give up on FATAL_CODES. It resets once a connection delivers
+		data again. Twitter sends a keep-alive every 30s or so, so a connection that's silent for
+		stall_timeout seconds is dead. '''
+	backoff	   = Backoff()
+	connects   = 0
+	while until is None or time.time() < until:
+		wait = None
+		try:
+			# the read timeout is per socket read, so it doubles as our stall detector
+			response = requests.get(url, auth=auth, stream=True, timeout=(connect_timeout,stall_timeout))
+		except NETWORK_ERRORS, e:
+			wait = backoff.network_error()
+			if doPrint:
+				print 'twitter connection error: {}, reconnecting in {}s'.format(str(e),wait)
+		else:
+			connects += 1
+			if response.status_code == 200:
+				if doPrint:
+					print 'twitter stream connected (connection #{})'.format(connects)
+				received = False
+				try:
+					for line in response.iter_lines():
+						if not received:
+							received = True
+							backoff.reset()
+						yield line
+						if until is not None and time.time() >= until:
+							break
+					else:
+						# server closed the stream on us
+						wait = backoff.network_error()
+				except NETWORK_ERRORS, e:
+					wait = backoff.network_error()
+					if doPrint:
+						print 'twitter stream dropped or stalled: {}, reconnecting in {}s'.format(str(e),wait)
+				finally:
+					response.close()
+			elif response.status_code in FATAL_CODES:
+				print 'ERROR Response code:{}, giving up: {}'.format(response.status_code,response.text[:200])
+				response.close()
+				return
+			else:
+				wait = backoff.http_error(response.status_code)
+				print 'ERROR Response code:{}, reconnecting in {}s'.format(response.status_code,wait)
+				response.close()
+
+		if wait is not None:
+			if until is not None:
+				wait = max(0, min(wait, until - time.time()))
+			time.sleep(wait)
@@ -1,7 +1,11 @@
 import time, json, boto3, re
-from dateutil import parser, tz
 from datetime import datetime, timedelta
 from sentiment import *
+from timeconv import convert_timezone, twitter_time_to_str
+from tweetfilter import prefilter_raw, raw_reason, project_tweet, keep_tweet
+from tweetrecord import Tweet
+from metrics import Counters
+from storage import get_store
 from pyspark.sql import SQLContext, Row
 import pyspark.sql.functions as sqlfunc
 from pyspark.sql.types import *
@@ -30,6 +34,64 @@ def pool_search_terms(j):
 	return search_terms
 
 
+class TermMatcher(object):
+	''' Matches tweet text against the full set of search terms with one precompiled regex.
+
+		We used to join all the terms into a new pattern string for every tweet, which meant each
+		record paid for building the pattern and looking it up in the re cache. Now we build the
+		alternation once on the driver (from pool_search_terms output) and ship this object to the
+		executors in the filter closure. Compiled patterns pickle as (pattern, flags), so each task
+		recompiles once on unpickling, not once per tweet.
+
+		Prefix rules are the same as before: a term has to follow whitespace, a # hashtag or an
+		@ mention. The start of the text also counts now (the old joined pattern let the first term
+		match anywhere, and every other term nowhere at the start of a tweet).
+
+		Terms are sorted longest-first so that the alternation prefers the most specific term
+		(eg. "hillaryclinton" over "hillary") when two terms start at the same position.
+
+		If candidates is given (the json_terms['candidates'][debate_party] dict of name -> terms),
+		scan() also reports which of those candidates a tweet mentions, from the same single pass
+		over the text. Terms that don't belong to one of these candidates (general debate terms, or
+		the other party's candidates) still count as a match, they just don't tag anybody. '''
+
+	def __init__(self,terms,candidates=None):
+		terms = set(t.lower() for t in terms if t)
+		self.owners = {} # term -> candidates who have it, a shared surname or hashtag tags all of them
+		if candidates is not None:
+			for name, cterms in sorted(candidates.items()):
+				for t in cterms:
+					owners = self.owners.setdefault(t.lower(),[])
+					if name not in owners:
+						owners.append( name )
+			terms.update(self.owners.keys())
+		terms = sorted(terms, key=len, reverse=True)
+		self.terms   = terms
+		self.pattern = re.compile(r'(?:^|(?<=[\s#@]))(?:' + '|'.join(re.escape(t) for t in terms) + ')',
+								  re.I|re.UNICODE)
+
+	def search(self,text):
+		''' True if text mentions at least one search term '''
+		return self.pattern.search(text) is not None
+
+	def scan(self,text):
+		''' Returns None if text doesn't match any search term.
+			Otherwise returns the list of candidates mentioned, in order of first mention,
+			or ['general'] if none of the matched terms belong to a specific candidate. '''
+		matched   = False
+		mentioned = []
+		for m in self.pattern.finditer(text):
+			matched = True
+			for name in self.owners.get(m.group().lower(),()):
+				if name not in mentioned:
+					mentioned.append( name )
+		if not matched:
+			return None
+		if len(mentioned) == 0: # if no candidates were mentioned specifically
+			mentioned.append( "general" ) # then tweet must be a general reference to the debate
+		return mentioned
+
+
 def get_hostname():
 	''' Determines whether we have a cluster up and running,
 		If so, returns master node private IP address for cluster coordination in spark-output.py '''
@@ -57,61 +119,64 @@ def get_hostname():
 
 
 def update_tz(d,dtype,only_tstamp=False):
-	''' Updates time zone for date stamp to US EST (the time zone of the debates) '''
+	''' Updates time zone for date stamp to US EST (the time zone of the debates) 
+		The conversion itself lives in timeconv.py, which the archive jobs share. '''
 	if only_tstamp:
 		tstamp = d 
 	else:
-		tstamp = d[1]
-	def convert_timezone(item,item_is_only_tstamp=False):
-		''' This interior function to update_tz does the actual conversion of timezones '''
-		if item_is_only_tstamp:
-			dt = item 
-		else:
-			ts = item['timestamp']
-			dt = parser.parse(ts)
-		from_zone = tz.gettz('UTC')
-		to_zone = tz.gettz('America/New_York')
-		utc = dt.replace(tzinfo=from_zone)
-		return utc.astimezone(to_zone)
+		tstamp = d[1]['timestamp']
 	if dtype == "sql": # if our return value is for Spark SQL
 		return Row(id=d[0], time=convert_timezone(tstamp))
 	elif dtype == "pandas": # if our return value is for non-Spark SQL (probably Pandas)
-		return convert_timezone(tstamp,only_tstamp)
+		return convert_timezone(tstamp)
 
 
-def make_json(tweet,interval):
-	''' Get stringified JSOn from Kafka, attempt to convert to JSON 
+def get_batchtime(batch_time,interval):
+	''' Turns the DStream batch time into the 'batchtime' we store every tweet of the batch under.
 
 		Note: The interval argument is BATCH_DURATION, ie. how many seconds each DStream collects for.
-			  This is important here because we use it to round all tweet timestamps to a 'batchtime' 
-			  timestamp, which is rounded to the floor of the nearest interval.
+			  The batchtime is rounded to the floor of the nearest interval.
 
 				Eg. interval = 30s, tstamp = 08:10:28 --> batchtime = 08:10:00
 					interval = 30s, tstamp = 08:10:32 --> batchtime = 08:10:30
 
 		We still retain the actual tweet timestamp, but the batchtime is what we use to store and
-		retrieve data from SDB (and it's how we render the chart on the front-end 
+		retrieve data from SDB (and it's how we render the chart on the front-end).
+
+		batch_time is the datetime Spark hands to transform()/foreachRDD() functions (naive, driver
+		local time), so this runs once per micro-batch on the driver, not once per tweet.
+
+		We return a plain UTC epoch (as a string, which is how SDB stores it). We used to push a
+		UTC datetime through update_tz and then strftime('%s'), which reads the America/New_York
+		wall-clock time back as if it were local time, so the epoch came out 4-5 hours off
+		depending on DST. The front-end no longer needs to add an offset for streaming data. '''
 
+	epoch = int(time.mktime(batch_time.timetuple()))
+	return str(interval * (epoch // interval))
 
-		WARNING: There seems to be a problem with the way we adjust for localtime here.
-				 As of 09 DEC, the epoch timestamp that comes out of this function is not correctly 
-				 adjusting to EST (GMT-0400 or GMT-0500 depending on DST). 
-				 You currently take care of this on the front-end with a conditional offset (because
-				 you do store the timezoned-timestamp correctly with the archival data, so you need an
-				 if-statement to figure out whether to add an extra offset). 
-				 But you should really fix this here.  It shouldn't be too hard to fix it. You're just
-				 short on time at this writing. '''
+
+def decode_tweet(raw,decode=json.loads,projected=True,prefiltered=False):
+	''' Decodes one raw Kafka line into a tweet dict, or None if it can't possibly pass filter_tweets.
+
+		With projected=True (the default), lines are first run through prefilter_raw, and the
+		decoded tweet is cut down to the projected fields (see project_tweet). With projected=False
+		this is just a full json decode of the line. prefiltered=True skips prefilter_raw,
+		for callers that already ran it. '''
+	if projected and not prefiltered and not prefilter_raw(raw):
+		return None
 	try:
-		dt           = datetime.now()
-		tstamp       = datetime(dt.year, dt.month, dt.day, dt.hour, dt.minute,interval*(dt.second // interval))
-		local_tstamp = update_tz(tstamp,"pandas",only_tstamp=True)
-		batchtime    = local_tstamp.strftime('%s')
-		return (batchtime, json.loads(tweet[1].decode('utf-8')))
+		tweet = decode(raw.decode('utf-8'))
 	except:
-		return "error on make_json"
+		return None
+	if not projected:
+		return tweet
+	try:
+		return project_tweet(tweet)
+	except (KeyError, TypeError):
+		return None
 
 
-def filter_tweets(item,terms):
+def filter_tweets(item,matcher):
 
 	''' Filters out the tweets we do not want.  Filters include:
 			* No non-tweets (eg. delete commands)
@@ -119,33 +184,33 @@ def filter_tweets(item,terms):
 			* English language only
 			* No tweets with links
 				- We need to check both entities and media fields for this (is that true?) 
-			* Matches at least one of the provided search terms '''
+			* Matches at least one of the provided search terms 
+
+		matcher is a TermMatcher built once from the pooled search terms (see spark-output.py).
 
-	# Define regex pattern that covers all search terms
-	pattern = '|(\s|#|@)'.join(terms)
+		Returns the list of candidates the tweet mentions (see TermMatcher.scan) if the tweet passes,
+		otherwise None. That way the text only gets scanned once, and get_relevant_fields just reuses
+		the candidate list we carry along with the tweet. '''
+	return check_tweet(item,matcher)[0]
 
-  
+
+def check_tweet(item,matcher):
+	''' filter_tweets, but also says why: returns (mentioned, None) if the tweet passes, otherwise
+		(None, reason), with the reasons from tweetfilter.keep_tweet plus 'no_match'. '''
 	try:
-		return (isinstance(item,dict) and 
-				('delete' not in item.keys()) and
-				('limit' not in item.keys()) and
-				('retweeted_status' not in item.keys())   and
-				(item['lang']=='en')                       and
-				(len(item['entities']['urls'])==0)                   and
-				('media' not in item['entities'].keys()) and
-				(re.search(pattern,item['text'],re.I) is not None)
-			   )
+		reason = keep_tweet(item)
+		if reason is not None:
+			return None, reason
+		mentioned = matcher.scan(item['text'])
+		if mentioned is None:
+			return None, 'no_match'
+		return mentioned, None
 	except Exception, e: 
-		return str(e)+"...We have this error under control"
-		#print 
-		#print "This item is funny.  Funny how?" 
-		#print str(e)
-		#print 'here is the item'
-		#print item
-		#print 
+		# "...We have this error under control"
+		return None, 'other'
 
 
-def get_relevant_fields(item,json_terms,debate_party):
+def get_relevant_fields(item):
 	''' Reduce the full set of metadata down to only those we care about, including:
 			* timestamp
 			* username
@@ -153,62 +218,257 @@ def get_relevant_fields(item,json_terms,debate_party):
 			* hashtags
 			* geotag coordinates (if any)
 			* location (user-defined in profile, not necessarily current location)
-	'''
 
-	the_tweet = item[1]
-	batchtime = item[0]
-	cands     = json_terms['candidates'][debate_party]
-	mentioned = []
+		item is (batchtime, tweet, mentioned), where mentioned is the candidate list that
+		filter_tweets already worked out, so we don't rescan the text once per candidate here.
 
-	# loop over candidates, check if tweet mentions each one
-	for name, terms in cands.items():
-		p = '|(\s|#|@)'.join(terms) # regex allows for # hashtag, @ mention, or blank space before term
-		rgx = re.search(p,the_tweet['text'],re.I)
-		if rgx: # if candidate-specific search term is matched
-			mentioned.append( name ) # add candidate surname to mentioned list
+		Returns a Tweet record (see tweetrecord.py), not a dict: tweets are cached and pickled a lot,
+		and a dict repeats all of its keys in every one of them.
+	'''
 
-	if len(mentioned) == 0: # if no candidates were mentioned specifically
-		mentioned.append( "general" ) # then tweet must be a general reference to the debate
+	batchtime, the_tweet, mentioned = item
 
-	tweet_timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(the_tweet['created_at'],'%a %b %d %H:%M:%S +0000 %Y'))
 	try:
-		return (the_tweet['id'], 
-				{"timestamp":       tweet_timestamp,
-				 "batchtime":       batchtime,
-				 "username":        the_tweet['user']['screen_name'],
-				 "text":            the_tweet['text'].encode('utf8').decode('ascii','ignore'),
-				 "hashtags":        [el['text'].encode('utf8').decode('ascii','ignore') for el in the_tweet['entities']['hashtags']],
-				 "first_term":      mentioned[0],
-				 "search_terms":    mentioned,
-				 "multiple_terms":  len(mentioned) > 1
-				}
-			   )
+		return Tweet(the_tweet['id'],
+					 batchtime,
+					 twitter_time_to_str(the_tweet['created_at']), # a bad created_at drops the tweet, not the partition
+					 the_tweet['user']['screen_name'],
+					 the_tweet['text'].encode('utf8').decode('ascii','ignore'),
+					 [el['text'].encode('utf8').decode('ascii','ignore') for el in the_tweet['entities']['hashtags']],
+					 mentioned
+					)
 	except Exception,e:
 		print "this error is coming from get_relevant_fields"
 		print str(e)
 		print "this is item:"
-		print item 
-		print 
-
-def make_row(d,doPrint=False):
-	tid = d[0]
-	tdata = d[1]
-
-	return Row(id             =tid,
-			   username       =tdata['username'],
-			   timestamp      =tdata['timestamp'],
-			   batchtime      =tdata['batchtime'],
-			   hashtags       =tdata['hashtags'] if tdata['hashtags'] is not None else '',
-			   text           =tdata['text'],
-			   search_terms   =tdata['search_terms'],
-			   multiple_terms =tdata['multiple_terms'],
-			   first_term     =tdata['first_term']
-			  )
-
-def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10,doPrint=False):
+		print item
+		print
+
+
+def ingest_partition(iterator,matcher,batchtime,projected=True,metrics=None):
+	''' Runs the whole ingest stage (decode_tweet -> filter_tweets -> get_relevant_fields) over one
+		partition of the Kafka DStream, via mapPartitions().
+
+		The JSON decoder is built once per partition, and the only things shipped in the closure
+		are the (small) TermMatcher and this batch's batchtime (see get_batchtime).
+
+		Lines are decoded with decode_tweet, so by default deletes, limits, retweets and non-English
+		tweets are rejected before parsing, and only the projected fields are kept.
+
+		Records that fail to decode, get filtered out, or blow up in get_relevant_fields are dropped.
+		If metrics (the accumulator from metrics.getMetricsInstance) is given, we count records in
+		and out, drops by reason (drop.retweet, drop.no_match, drop.decode, ...) and the time spent,
+		see metrics.py. The partition's records are all built before the first one is yielded, so
+		ingest.seconds doesn't include whatever runs downstream in the same worker. '''
+
+	decode	 = json.JSONDecoder().decode
+	counters = Counters(metrics)
+	start	 = time.time()
+	records	 = []
+
+	for record in iterator:
+		counters.add('ingest.records')
+		if projected:
+			reason = raw_reason(record[1])
+			if reason is not None:
+				counters.add('drop.'+reason)
+				continue
+		tweet = decode_tweet(record[1],decode,projected,prefiltered=True)
+		if tweet is None:
+			counters.add('drop.decode')
+			continue
 
-	rdd.cache()
+		mentioned, reason = check_tweet(tweet,matcher)
+		if mentioned is None:
+			counters.add('drop.'+reason)
+			continue
 
+		fields = get_relevant_fields((batchtime,tweet,mentioned))
+		if fields is not None:
+			records.append(fields)
+		else:
+			counters.add('drop.fields')
+
+	counters.add('ingest.out',len(records))
+	counters.add('ingest.seconds',time.time()-start)
+	counters.flush()
+	for fields in records:
+		yield fields
+
+
+class TweetColumns(object):
+	''' One partition's tweets as columns: numpy arrays for the candidate codes and word stats,
+		and one list of texts. Scoring and the per-candidate summaries (bincount/lexsort) run over
+		whole arrays, and a partition yields one summary per candidate, so the shuffle in
+		summarize_batch carries at most (candidates x partitions) records.
+
+		Usage:
+			cols = TweetColumns(tweets)
+			cols.score(getScorer(labMT))
+			for candidate, summary in cols.summaries(): ... '''
+
+	def __init__(self,tweets):
+		self.texts		= [t.text for t in tweets]
+		# candidates holds the distinct first_terms, codes the index into it for every tweet
+		self.candidates, self.codes = np.unique([t.first_term for t in tweets], return_inverse=True)
+		self.counts = self.sums = self.sumsSquared = None
+
+	def score(self,scorer):
+		''' labMT word counts, sums and sums of squares for every tweet, in one sparse matrix product '''
+		self.counts, self.sums, self.sumsSquared, totals = scorer.wordStats(self.texts)
+		return self
+
+	def summaries(self):
+		''' Yields (candidate, summary) per candidate, where a summary is
+				(num_tweets, num_scored, emotionStats, (highest avg, tweet), (lowest avg, tweet))
+			Tweets with no labMT words count towards num_tweets but not towards anything else, and
+			a candidate with no scored tweets gets None for both tweets. Summaries from different
+			partitions combine with merge_summaries. '''
+		k		   = len(self.candidates)
+		codes	   = self.codes
+		scored	   = self.counts > 0
+		num_tweets = np.bincount(codes, minlength=k)
+		num_scored = np.bincount(codes, weights=scored, minlength=k)
+		counts	   = np.bincount(codes, weights=self.counts, minlength=k)
+		sums	   = np.bincount(codes, weights=self.sums, minlength=k)
+		squares	   = np.bincount(codes, weights=self.sumsSquared, minlength=k)
+
+		# per-tweet averages of the scored tweets, sorted by candidate and then average, so each
+		# candidate's lowest tweet is the first of its run and the highest is the last
+		idx	  = np.flatnonzero(scored)
+		avg	  = self.sums[idx] / self.counts[idx]
+		order = np.lexsort((avg, codes[idx]))
+		idx, avg, run = idx[order], avg[order], codes[idx][order]
+		firsts = np.searchsorted(run, np.arange(k), side='left')
+		lasts  = np.searchsorted(run, np.arange(k), side='right') - 1
+
+		for c in range(k):
+			if num_scored[c] > 0:
+				low, high = (float(avg[firsts[c]]), self.texts[idx[firsts[c]]]), (float(avg[lasts[c]]), self.texts[idx[lasts[c]]])
+				stats = (int(counts[c]), float(sums[c]), float(squares[c]), low[0], high[0])
+			else:
+				low = high = None
+				stats = emotionStats(int(counts[c]), float(sums[c]), float(squares[c]))
+			yield (str(self.candidates[c]), (int(num_tweets[c]), int(num_scored[c]), stats, high, low))
+
+
+def score_partition(iterator,labMT,metrics=None):
+	''' Scores a whole partition of Tweet records in one go with the vectorized EmotionScorer,
+		and yields one (first_term, candidate summary) pair per candidate, see TweetColumns. '''
+	tweets = list(iterator)
+	if len(tweets) == 0:
+		return
+	start = time.time()
+	pairs = list(TweetColumns(tweets).score(getScorer(labMT)).summaries())
+	counters = Counters(metrics)
+	counters.add('score.records',len(tweets))
+	counters.add('score.seconds',time.time()-start)
+	counters.flush()
+	for pair in pairs:
+		yield pair
+
+
+def merge_summaries(a,b):
+	''' Combines two candidate summaries (see TweetColumns.summaries), for reduceByKey/aggregateByKey '''
+	def pick(x,y,better):
+		if x is None: return y
+		if y is None: return x
+		return x if better(x[0],y[0]) else y
+	return (a[0]+b[0], 
+			a[1]+b[1], 
+			mergeEmotionStats(a[2],b[2]),
+			pick(a[3],b[3],lambda x,y: x >= y),
+			pick(a[4],b[4],lambda x,y: x <= y)
+		   )
+
+
+def summarize_batch(rdd,labMT,n_parts=10,metrics=None):
+	''' One job per batch: score each partition, then reduce the partitions' candidate summaries by first_term.
+		We used to run a SQL query, an accumulator count, first(), two takeOrdered() and a collect()
+		per candidate, ie. ~8 Spark jobs x ~17 candidates, which blew through our batch window.
+		The reduced output is at most one small summary per candidate (see TweetColumns.summaries).
+
+		labMT is the Spark broadcast of the emotionFileReader() dict, loaded once on the driver.
+		Closures below only reference the broadcast handle and read labMT.value on the executors,
+		so the ~10k word dict isn't pickled into every task. '''
+	return (rdd.mapPartitions( lambda part: score_partition(part,labMT,metrics) )
+			   .reduceByKey( merge_summaries, numPartitions=n_parts )
+		   )
+
+
+def window_stats(summary):
+	''' Invertible part of a candidate summary: (num_tweets, scored words, sum, sum of squares).
+		Highest/lowest tweets (and min/max) can't be subtracted back out of a window, so they
+		only exist per batch. '''
+	num_tweets, num_scored, stats, high, low = summary
+	return (num_tweets, stats[0], stats[1], stats[2])
+
+
+def add_window_stats(a,b):
+	return (a[0]+b[0], a[1]+b[1], a[2]+b[2], a[3]+b[3])
+
+
+def subtract_window_stats(a,b):
+	''' Inverse of add_window_stats, for reduceByKeyAndWindow '''
+	diff = (a[0]-b[0], a[1]-b[1], a[2]-b[2], a[3]-b[3])
+	if diff[1] == 0: # no words left, don't keep floating point leftovers around
+		diff = (diff[0], 0, 0.0, 0.0)
+	return diff
+
+
+def update_cumulative(new_values,state):
+	''' updateStateByKey function: running window_stats for the whole debate so far '''
+	if state is None:
+		state = (0, 0, 0.0, 0.0)
+	for ws in new_values:
+		state = add_window_stats(state,ws)
+	return state
+
+
+def write_rolling(rdd,batchtime,store=None,domain_name='rolling',doPrint=False):
+	''' Writes the rolling sentiment series for one batch, one item per candidate.
+
+		rdd holds (candidate, (window name, window_stats)) pairs, for every window we track
+		(eg. window_1m, window_5m, cumulative; see spark-output.py). Each item gets a data attribute
+		with {window name: {num_tweets, sentiment_avg, sentiment_std}}, plus timestamp and candidate
+		attributes like the sentiment domain, so the front-end can read the rolling views without
+		re-pulling every historical row. '''
+	series = {}
+	for candidate, (window, ws) in rdd.collect():
+		num_tweets, count, total, totalSquared = ws
+		sentiment_avg, sentiment_std = emotionStatsSummary((count,total,totalSquared))
+		series.setdefault(candidate,{'batchtime':batchtime})[window] = {
+								'num_tweets':    str(num_tweets),
+								'sentiment_avg': str(sentiment_avg) if sentiment_avg is not None else '',
+								'sentiment_std': str(sentiment_std) if sentiment_std is not None else ''
+							 }
+	if len(series) == 0:
+		return
+
+	items = []
+	for cname, data in series.items():
+		attrs = [{'Name':"data",      'Value':json.dumps(data),'Replace':True},
+				 {"Name":"timestamp", "Value":batchtime,       "Replace":True},
+				 {"Name":"candidate", "Value":cname,           "Replace":True}]
+		items.append( ('_'.join([cname,batchtime]),attrs) )
+
+	if store is None:
+		store = get_store(doPrint=doPrint)
+	store.put_items(domain_name,items)
+
+
+def process(rdd,json_terms,debate_party,batchtime,store=None,offsets=None,domain_name='sentiment',doPrint=False):
+	''' Writes per-candidate tweet counts and sentiment for one micro-batch to SDB.
+
+		rdd is this batch's per-candidate summaries, from summarize_batch.
+
+		offsets is the batch's Kafka offset range key (see get_offsets). It goes into the item names,
+		so that re-running a batch after a driver restart overwrites the same items.
+
+		batchtime is this micro-batch's get_batchtime() value. Candidates with no tweets in the batch
+		still get a row, with num_tweets '0' and empty sentiment fields.
+
+		store is where results go (see storage.py), defaults to get_store(). '''
 
 	candidate_dict = {}
 	candidate_names = json_terms['candidates'][debate_party].keys()
@@ -216,7 +476,7 @@ def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10,doPri
 
 	for candidate in candidate_names:
 		candidate_dict[candidate] =  {'party':debate_party if candidate is not 'general' else 'general',
-									  'batchtime':'',
+									  'batchtime':batchtime,
 									  'num_tweets':'0',
 									  'sentiment_avg':'',
 									  'sentiment_std':'',
@@ -224,134 +484,47 @@ def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10,doPri
 									  'lowest_sentiment_tweet':''
 									 }
 
-	# default settings remove words scored 4-6 on the scale (too neutral). 
-	# adjust with kwarg stopval, determines 'ignore spread' out from 5. eg. default stopval = 1.0 (4-6)
-	labMT = emotionFileReader() 
-
-	# Get the singleton instance of SQLContext
-	sqlContext = getSqlContextInstance(rdd.context)
-
-	schema = StructType([StructField("batchtime",       StringType()           ),
-						 StructField("first_term",      StringType()           ),
-						 StructField("hashtags",        ArrayType(StringType())),
-						 StructField("id",              IntegerType()          ),
-						 StructField("multiple_terms",  BooleanType()          ),
-						 StructField("search_terms",    ArrayType(StringType())),
-						 StructField("text",            StringType()           ),
-						 StructField("timestamp",       StringType()           ),
-						 StructField("username",        StringType()           )
-						]
-					   )
-	# Convert RDD[String] to RDD[Row] to DataFrame
-	row_rdd = rdd.map(lambda data: make_row(data))
-	df = sqlContext.createDataFrame(row_rdd, schema)
-
-	# how many tweets per candidate per batch?
-	df2 = (df.groupBy("first_term")
-			 .count()
-			 .alias('df2')
-		  )
-
-	counts = (df2.map(lambda row: row.asDict() )
-				 .map(lambda row: (row['first_term'],row['count']))
-			  )
-
-	cRdd = rdd.context.parallelize( candidate_names, n_parts )
-
-	def update_dict(d):
-		data = d[0]
-		data['num_tweets'] = str(d[1]) if d[1] is not None else data['num_tweets']
-		return data 
-
-	tmp = (cRdd.map( lambda c: (c, candidate_dict[c]), preservesPartitioning=True )
-			   .leftOuterJoin( counts, numPartitions=n_parts )
-			   .map( lambda data: (data[0], update_dict(data[1])) )
-			   .collect()
-		  )
-	candidate_dict = { k:v for k,v in tmp }
-
-	# Register as table
-	df.registerTempTable("tweets")
-	# loop over candidates, check if tweet mentions each candidate
-	for candidate in candidate_names:
-		if doPrint:
-			print
-			print 'CANDIDATE NAME:'
-			print candidate 
-			print
-		try:
-			accum = rdd.context.accumulator(0)
-
-			query = "SELECT batchtime, text FROM tweets WHERE first_term='{}'".format(candidate)
-
-			result = sqlContext.sql(query)
-
-			scored = result.map( lambda x: (x.batchtime, (emotion(x.text,labMT), x.text)) ).cache()
-
-
-			scored.foreach(lambda x: accum.add(1))
-
-			batchtime = scored.first()[0]
-
-
-			if accum.value > 0:
-				accum2 = rdd.context.accumulator(0)
-
-				scored = scored.filter(lambda score: score[1][0][0] is not None).cache()
-		   
-			scored.foreach(lambda x: accum2.add(1))
-			if accum2.value > 1: # we want at least 2 tweets for highest and lowest scoring
-  
-				high_parts = scored.takeOrdered(1, key = lambda x: -x[1][0][0])[0][1]
-				high_scores, high_tweet = high_parts
-				
-				high_avg = str(high_scores[0])
-				high_tweet = high_tweet.encode('utf8').decode('ascii','ignore')
-				
-				low_parts  = scored.takeOrdered(1, key = lambda x:  x[1][0][0])[0][1]
-				
-				low_scores, low_tweet = low_parts
-				low_avg = str(low_scores[0])
-				low_tweet = low_tweet.encode('utf8').decode('ascii','ignore')
-
-			else:
-				high_avg = low_avg = high_tweet = low_tweet = ''
-
-
-			candidate_dict[candidate]['highest_sentiment_tweet'] = '_'.join([high_avg,high_tweet])
-			candidate_dict[candidate]['lowest_sentiment_tweet']  = '_'.join([low_avg,low_tweet])  
-
-			sentiment = (result.map(lambda x: (1,x.text))
-									.reduceByKey(lambda x,y: ' '.join([str(x),str(y)]))
-									.map( lambda text: emotion(text[1],labMT) )
-									.collect()
-							 )
+	# at most one small summary per candidate, so collecting it is cheap
+	summaries = rdd.collectAsMap()
 
+	if len(summaries) == 0: # nothing came in this batch
+		if doPrint:
+			print "No tweets in batch {}".format(batchtime)
+		return
 
-			sentiment_avg, sentiment_std = sentiment[0]
+	for candidate, summary in summaries.items():
+		if candidate not in candidate_dict: # shouldn't happen, first_term is always one of candidate_names
+			continue
+		num_tweets, num_scored, stats, high, low = summary
 
+		candidate_dict[candidate]['num_tweets'] = str(num_tweets)
 
+		if num_scored > 0:
+			sentiment_avg, sentiment_std = emotionStatsSummary(stats)
 			candidate_dict[candidate]['sentiment_avg'] = str(sentiment_avg)
 			candidate_dict[candidate]['sentiment_std'] = str(sentiment_std) 
-			candidate_dict[candidate]['batchtime'] = batchtime
 
-		except Exception,e:
-			if doPrint:
-				print "Looks like this candidate doesn't have any data"
-				print str(e)
-			continue
+		if num_scored > 1: # we want at least 2 tweets for highest and lowest scoring
+			candidate_dict[candidate]['highest_sentiment_tweet'] = '_'.join([str(high[0]),high[1]])
+			candidate_dict[candidate]['lowest_sentiment_tweet']  = '_'.join([str(low[0]),low[1]])  
 
+		if doPrint:
+			print
+			print 'CANDIDATE NAME:'
+			print candidate 
+			print candidate_dict[candidate]
+			print
 
-	import boto3,json
-	client = boto3.client('sdb')
 
+	items = []
 	for cname,cdata in candidate_dict.items():
 		attrs = []
-		attrs.append( {'Name':"data",'Value':json.dumps(candidate_dict[cname]),'Replace':False} )
-		attrs.append( {"Name":"timestamp", "Value": batchtime, "Replace":False}  )
-		attrs.append( {"Name":"candidate", "Value": cname, "Replace":False}  )
+		attrs.append( {'Name':"data",'Value':json.dumps(candidate_dict[cname]),'Replace':True} )
+		attrs.append( {"Name":"timestamp", "Value": batchtime, "Replace":True}  )
+		attrs.append( {"Name":"candidate", "Value": cname, "Replace":True}  )
 
-		item_name = '_'.join([cname,batchtime])
+		# Kafka offsets in the item name + Replace=True: rewriting a replayed batch is a no-op
+		item_name = '_'.join([cname,batchtime,offsets]) if offsets else '_'.join([cname,batchtime])
 
 		if doPrint:
 			print 
@@ -359,15 +532,7 @@ def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10,doPri
 			print item_name
 			#print attrs 
 
-		try:
-			# write row of data to SDB
-			client.put_attributes(
-				DomainName= domain_name,
-				ItemName  = item_name,
-				Attributes= attrs 
-			) 
-		except Exception,e:
-			print 'sdb write error: {}'.format(str(e))
+		items.append( (item_name,attrs) )
 
 		#rdd.foreachPartition(lambda p: write_to_db(p,level='group'))
 	#except Exception, e:
@@ -377,7 +542,86 @@ def process(rdd,json_terms,debate_party,domain_name='sentiment',n_parts=10,doPri
 	#    print
 	#    pass
 
+	# one bulk write for all candidates (eg. a single batch_put_attributes call for SDB)
+	if store is None:
+		store = get_store(doPrint=doPrint)
+	store.put_items(domain_name,items)
+
+
+
+
+''' Kafka offset bookkeeping for the result writes.
+
+	The direct Kafka stream knows which offsets each batch covers (rdd.offsetRanges(), only on
+	the RDD straight out of createDirectStream). We record them on the driver in the batch's first
+	output operation (kstream.foreachRDD(record_offsets)), use them in the sentiment item names,
+	and commit the until-offsets to the store once all of the batch's writes are done
+	(commit_offsets, registered as the last output operation). Output operations run for every
+	batch, including batches re-run after a checkpoint restore, whose Kafka RDDs come back with
+	their offset ranges.
 
+	This lives in utils (not spark-output.py) so that functions restored from a checkpoint still
+	share the same dict: module functions are pickled by reference, __main__ ones by value. '''
+_batch_offsets = {}
+
+def record_offsets(batch_time,rdd):
+	''' Remembers the Kafka offset ranges of the batch generated at batch_time '''
+	_batch_offsets[batch_time] = [(o.topic, o.partition, o.fromOffset, o.untilOffset) for o in rdd.offsetRanges()]
+
+
+def get_offsets(batch_time):
+	''' Offset range key for a batch, eg. "0:1200-1350" or "0:1200-1350.1:980-1102" '''
+	ranges = _batch_offsets.get(batch_time,[])
+	return '.'.join('{}:{}-{}'.format(partition,start,until) for topic,partition,start,until in sorted(ranges,key=lambda r: r[1]))
+
+
+def get_batch_records(batch_time):
+	''' How many Kafka records the batch generated at batch_time covers '''
+	return sum(until - start for topic,partition,start,until in _batch_offsets.get(batch_time,[]))
+
+
+def commit_offsets(batch_time,store=None,domain_name='offsets'):
+	''' Stores the until-offset of every topic partition in the batch, after all its writes succeeded.
+		Item names are topic_partition, so there's only ever one committed offset per partition. '''
+	ranges = _batch_offsets.pop(batch_time,[])
+	# forget about batches that never made it this far
+	for old in [t for t in _batch_offsets if t < batch_time]:
+		del _batch_offsets[old]
+	if len(ranges) == 0:
+		return
+	items = [('_'.join([topic,str(partition)]),
+			  [{'Name':'topic',     'Value':topic,          'Replace':True},
+			   {'Name':'partition', 'Value':str(partition), 'Replace':True},
+			   {'Name':'offset',    'Value':str(until),     'Replace':True}])
+			 for topic,partition,start,until in ranges]
+	if store is None:
+		store = get_store()
+	store.put_items(domain_name,items)
+
+
+def load_committed_offsets(topic,store=None,domain_name='offsets'):
+	''' Returns {partition: offset} for topic, the offsets to resume from in fast recovery mode '''
+	if store is None:
+		store = get_store()
+	offsets = {}
+	for item, attrs in store.select_all(domain_name).items():
+		a = dict((attr['Name'],attr['Value']) for attr in attrs)
+		if a.get('topic') == topic:
+			offsets[int(a['partition'])] = long(a['offset'])
+	return offsets
+
+
+def getLabMTInstance(sparkContext):
+	''' Lazily instantiated global broadcast of the labMT dict.
+
+		Broadcast variables can't be restored from a streaming checkpoint, so DStream functions
+		shouldn't close over one. They call this (on the driver) instead, which broadcasts the
+		dict the first time it's needed after a (re)start. '''
+	if ('labMTSingletonInstance' not in globals()):
+		# default settings remove words scored 4-6 on the scale (too neutral). 
+		# adjust with kwarg stopval, determines 'ignore spread' out from 5. eg. default stopval = 1.0 (4-6)
+		globals()['labMTSingletonInstance'] = sparkContext.broadcast(emotionFileReader())
+	return globals()['labMTSingletonInstance']
 
 
 # From Thouis 'Ray' Jones CS205
@@ -418,8 +662,9 @@ def getSqlContextInstance(sparkContext):
 	return globals()['sqlContextSingletonInstance']
 
 
-def write_to_db(iterator,level='tweet',domain_name='tweets'):
+def write_to_db(iterator,level='tweet',domain_name='tweets',store=None,doPrint=True,metrics=None):
 	''' Write output to AWS SimpleDB table after analysis is complete 
+			- Goes through store (see storage.py), which is SDB unless configured otherwise.
 			- Uses boto3 and credentials file. (If AWS cluster, credentials are associated with creator.)
 			- UTF-8 WARNING!
 				* SDB does not like weird UTF-8 characters, including emojis. 
@@ -433,11 +678,25 @@ def write_to_db(iterator,level='tweet',domain_name='tweets'):
 			  Assuming this has something to do with child nodes running this function but not the whole
 			  script?  
 			  When we import boto3 inside this function, everything works.
+			  (SDBWriter still imports boto3 locally, and keeps one client per executor process.)
 	'''
-	import boto3            # keep local boto import!
-	client = boto3.client('sdb', region_name='us-east-1')
+	if store is None:
+		store = get_store(doPrint=doPrint)
+	start = time.time()
+	stats = store.put_items(domain_name,tweet_items(iterator))
+	# write latency: SDB reports how long its batch calls took, other stores just get timed whole
+	counters = Counters(metrics)
+	counters.add('write.items',stats.get('items',0))
+	counters.add('write.failed',stats.get('failed',0))
+	counters.add('write.batches',stats.get('batches',1))
+	counters.add('write.seconds',stats.get('seconds',time.time()-start))
+	counters.flush()
+
+
+def tweet_items(iterator):
+	''' Turns Tweet records into (item_name, attrs) pairs for Store.put_items.
 
-	''' write_to_db() is called by foreachPartition(), which passes in an iterator object automatically.
+		write_to_db() is called by foreachPartition(), which passes in an iterator object automatically.
 
 		The iterator rows are each entry (for now, that means "each tweet") in the dataset. 
 		Below, we use the implicitly-passed iterator to loop through each data point and write to SDB.
@@ -451,12 +710,13 @@ def write_to_db(iterator,level='tweet',domain_name='tweets'):
 				make sure to check and see if the author has answered you!
 	'''
 
-	for row in iterator:
-		k,v = row
+	for tweet in iterator:
 		attrs = []
 
 		try:
-			for k2,v2 in v.items():
+			for k2,v2 in tweet.items():
+				if k2 == "id": # the item name, not an attribute
+					continue
 				# If v2 IS A LIST: join as comma-separated string
 				if isinstance(v2,list):
 					v2 = ','.join([val for val in v2]) if len(v2)>0 else ''
@@ -469,22 +729,12 @@ def write_to_db(iterator,level='tweet',domain_name='tweets'):
 				# Get rid of all UTF-8 weirdness, including emojis.
 				if k2 != "batchtime":
 					v2 = v2.encode('utf8').decode('ascii','ignore')
-				attrs.append( {'Name':k2,'Value':v2,'Replace':False} )
+				attrs.append( {'Name':k2,'Value':v2,'Replace':True} ) # Replace, so replayed batches don't pile up values
 		except Exception, e:
 			print 'This error is from write_to_db'
 			print str(e)
-			print v 
-		try:
-			# write row of data to SDB
-			client.put_attributes(
-				DomainName= domain_name,
-				ItemName  = str(k),
-				Attributes= attrs 
-			) 
-		except Exception, e:
-			print "This error is from write_to_db"
-			print str(e)
-			print attrs
-			print
+			print tweet
+		# row of data for the store, SDB sends these out in batches of 25 items
+		yield (str(tweet.id),attrs)
 
 